@@ -0,0 +1,102 @@
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки кэша ответов (можно переопределить через .env)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))  # максимум записей
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))  # лимит памяти на ответы
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))  # время жизни записи, сек.
+
+_spaces = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, пробелы и пунктуация не учитываются"""
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    # Пунктуацию и спецсимволы заменяем пробелами ("адрес офиса?" == "Адрес  офиса")
+    text = "".join(" " if unicodedata.category(ch)[0] in "PS" else ch for ch in text)
+    return _spaces.sub(" ", text).strip()
+
+
+class AnswerCache:
+    """LRU-кэш ответов LLM по нормализованному тексту вопроса с TTL и лимитом памяти"""
+
+    def __init__(self,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+                 ttl: float = ANSWER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # ключ -> (момент истечения, ответ); порядок = порядок последнего использования
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _weight(key: str, answer: str) -> int:
+        return len(key.encode()) + len(answer.encode())
+
+    def _pop(self, key: str):
+        _, answer = self._entries.pop(key)
+        self._bytes -= self._weight(key, answer)
+
+    def get(self, question: str) -> str | None:
+        key = normalize_question(question)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, answer = entry
+        if expires_at < time.monotonic():
+            # Запись устарела - удаляем и идём в LLM
+            self._pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return answer
+
+    def set(self, question: str, answer: str):
+        key = normalize_question(question)
+        if not key or not answer:
+            return
+        weight = self._weight(key, answer)
+        if weight > self.max_bytes:
+            return  # слишком большой ответ не кэшируем, чтобы не вытеснять весь кэш
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, answer)
+        self._bytes += weight
+        # Вытесняем давно не использованные записи, пока не уложимся в лимиты
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def clear(self) -> int:
+        """Очищает кэш и возвращает количество удалённых записей"""
+        removed = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        logger.info(f"Кэш ответов очищен, удалено записей: {removed}")
+        return removed
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,91 @@
+import logging
+import os
+import random
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки опроса готовности ответа ValueAI (можно переопределить через .env)
+POLL_DEADLINE = float(os.getenv("VALUEAI_POLL_DEADLINE", "30"))  # общий лимит ожидания ответа, сек.
+POLL_MIN_INTERVAL = float(os.getenv("VALUEAI_POLL_MIN_INTERVAL", "0.2"))  # минимальный шаг опроса, сек.
+POLL_MAX_INTERVAL = float(os.getenv("VALUEAI_POLL_MAX_INTERVAL", "2"))  # максимальный шаг опроса, сек.
+POLL_JITTER = float(os.getenv("VALUEAI_POLL_JITTER", "0.15"))  # случайный разброс шага (доля)
+POLL_HISTORY = int(os.getenv("VALUEAI_POLL_HISTORY", "500"))  # сколько последних времён ответа помнить
+# Сколько ошибок 5xx подряд терпеть при опросе, прежде чем считать запрос неудачным
+POLL_MAX_SERVER_ERRORS = int(os.getenv("VALUEAI_POLL_MAX_SERVER_ERRORS", "3"))
+# Сколько опросов делать в «плотной» зоне между 10-м и 90-м перцентилем времени ответа
+POLL_DENSE_STEPS = 8
+# Ожидаемое время ответа, пока нет ни одного наблюдения (по statistics_table ~4 сек.)
+POLL_DEFAULT_ANSWER_TIME = 4.0
+
+
+class AnswerPollScheduler:
+    """Расписание опросов готовности ответа, подстраивающееся под распределение времени ответа LLM"""
+
+    def __init__(self,
+                 deadline: float = POLL_DEADLINE,
+                 min_interval: float = POLL_MIN_INTERVAL,
+                 max_interval: float = POLL_MAX_INTERVAL,
+                 jitter: float = POLL_JITTER,
+                 history: int = POLL_HISTORY):
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        # Наблюдаемые времена готовности ответа (от создания чата), сек.
+        self._samples: deque[float] = deque(maxlen=history)
+        self.answers = 0
+        self.total_polls = 0
+        self.last_polls = 0
+
+    def seed(self, answer_times):
+        """Заполняет историю начальными значениями (например, из statistics_table.llm_time)"""
+        self._samples.extend(float(t) for t in answer_times if t and t > 0)
+
+    async def load(self, db):
+        self.seed(await db.fetch_answer_times(self._samples.maxlen))
+        logger.info(f"Расписание опроса ValueAI: загружено {len(self._samples)} времён ответа")
+
+    def record(self, answer_time: float, polls: int):
+        """Запоминает, за сколько секунд и опросов был получен ответ"""
+        self._samples.append(answer_time)
+        self.answers += 1
+        self.total_polls += polls
+        self.last_polls = polls
+
+    def _quantile(self, q: float) -> float:
+        if not self._samples:
+            return POLL_DEFAULT_ANSWER_TIME
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def schedule(self):
+        """Генератор моментов опроса (сек. от создания чата), не выходящих за deadline"""
+        low, high = self._quantile(0.1), self._quantile(0.9)
+        # Первый опрос чуть раньше самых быстрых ответов
+        t = max(self.min_interval, low * 0.8)
+        # Между p10 и p90 ответ появляется чаще всего - опрашиваем плотно
+        dense = min(max((high - low) / POLL_DENSE_STEPS, self.min_interval), self.max_interval / 2)
+        interval = dense
+        while t <= self.deadline:
+            yield t
+            if t >= high:
+                # Ответ запаздывает - постепенно увеличиваем шаг
+                interval = min(interval * 1.5, self.max_interval)
+            t += self._jittered(interval)
+
+    def stats(self) -> dict:
+        return {
+            "answers": self.answers,
+            "avg_polls": self.total_polls / self.answers if self.answers else 0.0,
+            "p50": self._quantile(0.5),
+            "p90": self._quantile(0.9),
+        }
@@ -0,0 +1,105 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки кэша авторизации (можно переопределить через .env)
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))  # время жизни положительного ответа, сек.
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "30"))  # время жизни «не найдено», сек.
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))  # максимум записей в каждой таблице
+
+# Признак промаха кэша (None - допустимое закэшированное значение is_user_admin)
+MISSING = object()
+
+
+class AuthCache:
+    """Кэш проверок login_exists / is_user_admin с TTL и кэшированием отрицательных ответов"""
+
+    def __init__(self,
+                 ttl: float = AUTH_CACHE_TTL,
+                 negative_ttl: float = AUTH_CACHE_NEGATIVE_TTL,
+                 max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # login -> (момент истечения, логин существует)
+        self._logins: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+        # (login, tg_id) -> (момент истечения, is_admin или None, если логин и tg_id не связаны)
+        self._admins: OrderedDict[tuple[str, int], tuple[float, bool | None]] = OrderedDict()
+        # Растёт при каждой инвалидации: результат запроса, начатого до изменения в БД, не кэшируется
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _get(self, table: OrderedDict, key):
+        entry = table.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del table[key]
+            self.misses += 1
+            return MISSING
+        table.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def _set(self, table: OrderedDict, key, value, positive: bool, generation: int):
+        if generation != self.generation:
+            return  # пока шёл запрос, данные в БД поменялись
+        ttl = self.ttl if positive else self.negative_ttl
+        if ttl <= 0:
+            return
+        table[key] = (time.monotonic() + ttl, value)
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def get_login(self, login: str):
+        return self._get(self._logins, login)
+
+    def set_login(self, login: str, exists: bool, generation: int):
+        self._set(self._logins, login, exists, exists, generation)
+
+    def get_admin(self, login: str, tg_id: int):
+        return self._get(self._admins, (login, tg_id))
+
+    def set_admin(self, login: str, tg_id: int, is_admin: bool | None, generation: int):
+        self._set(self._admins, (login, tg_id), is_admin, is_admin is not None, generation)
+
+    def invalidate_login(self, login: str):
+        """Сбрасывает всё, что закэшировано для логина (после добавления/удаления/смены прав)"""
+        self.generation += 1
+        self.invalidations += 1
+        self._logins.pop(login, None)
+        for key in [key for key in self._admins if key[0] == login]:
+            del self._admins[key]
+
+    def invalidate_tg_id(self, tg_id: int):
+        """Сбрасывает проверки прав для tg_id (после добавления/удаления сессии)"""
+        self.generation += 1
+        self.invalidations += 1
+        for key in [key for key in self._admins if key[1] == tg_id]:
+            del self._admins[key]
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += 1
+        self._logins.clear()
+        self._admins.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._logins) + len(self._admins),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import os
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Канал Postgres, в который триггеры login_table/sessions публикуют изменения (миграция 001)
+AUTH_CHANNEL = "hr_auth_changes"
+AUTH_LISTEN_RECONNECT_DELAY = float(os.getenv("AUTH_LISTEN_RECONNECT_DELAY", "1"))  # первая пауза перед переподключением
+AUTH_LISTEN_MAX_RECONNECT_DELAY = float(os.getenv("AUTH_LISTEN_MAX_RECONNECT_DELAY", "30"))  # максимальная пауза, сек.
+
+
+class AuthChangeListener:
+    """Слушает канал изменений логинов и сессий на отдельном соединении (LISTEN) и раздаёт события подписчикам"""
+
+    def __init__(self, db, channel: str = AUTH_CHANNEL):
+        self.db = db
+        self.channel = channel
+        # Асинхронные функции listener(event), event = {"table": ..., "op": ..., "row": {...}}
+        self._listeners = []
+        self._task: asyncio.Task | None = None
+        self._handlers: set[asyncio.Task] = set()
+        # Время сервера, с которого события уже получены (для догоняющего чтения после обрыва)
+        self._since = None
+        self.received = 0
+        self.reconnects = 0
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._handlers:
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _connect(self) -> asyncpg.Connection:
+        return await asyncpg.connect(
+            user=self.db.user,
+            password=self.db.password,
+            database=self.db.database,
+            host=self.db.host,
+            port=self.db.port
+        )
+
+    async def _run(self):
+        delay = AUTH_LISTEN_RECONNECT_DELAY
+        while True:
+            connection = None
+            try:
+                connection = await self._connect()
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(self.channel, self._on_notify)
+                await self._catch_up(connection)
+                logger.info(f"Подписка на изменения авторизации (LISTEN {self.channel}) активна")
+                delay = AUTH_LISTEN_RECONNECT_DELAY
+                await lost.wait()
+                logger.warning("Соединение LISTEN с Postgres потеряно, переподключаемся")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка подписки на изменения авторизации: {e}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close(timeout=1)
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, AUTH_LISTEN_MAX_RECONNECT_DELAY)
+
+    async def _catch_up(self, connection: asyncpg.Connection):
+        """После переподключения восстанавливает пропущенные отзывы доступа"""
+        now = await connection.fetchval("SELECT now()::timestamp")
+        if self._since is not None:
+            # Пока LISTEN не работал, уведомления терялись: локальные кэши могли устареть целиком
+            self._dispatch({"table": None, "op": "RESYNC", "row": {}})
+            # Удаления логинов с привязанными tg_id записываются триггером log_deleted_sessions
+            rows = await connection.fetch(
+                "SELECT login, tg_id FROM deleted_sessions_log WHERE deleted_at >= $1",
+                self._since
+            )
+            for row in rows:
+                self._dispatch({"table": "sessions", "op": "DELETE", "row": dict(row)})
+            logger.info(f"После переподключения восстановлено отзывов доступа: {len(rows)}")
+        self._since = now
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.error(f"Некорректное уведомление в канале {channel}: {payload!r}")
+            return
+        self.received += 1
+        self._dispatch(event)
+
+    def _dispatch(self, event: dict):
+        for listener in self._listeners:
+            task = asyncio.create_task(self._call(listener, event))
+            self._handlers.add(task)
+            task.add_done_callback(self._handlers.discard)
+
+    @staticmethod
+    async def _call(listener, event: dict):
+        try:
+            await listener(event)
+        except Exception as e:
+            logger.error(f"Ошибка обработки изменения авторизации {event}: {e}")
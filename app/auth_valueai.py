@@ -3,6 +3,14 @@
 # - Работа с файловой системой
 import os
 
+# Асинхронные задачи: фоновое обновление токена и единый запрос обновления для всех
+import asyncio
+
+# Разбор JWT (payload закодирован base64url и содержит поле exp)
+import base64
+import json
+import time
+
 # Импорт модуля логирования для записи событий и ошибок
 # - Настройка уровней логирования (DEBUG, INFO, WARNING, ERROR, CRITICAL)
 # - Вывод логов в консоль/файл
@@ -13,11 +21,6 @@ import logging
 # - Безопасное хранение чувствительных данных (логины, пароли, ключи API)
 from dotenv import load_dotenv
 
-# Импорт библиотеки для асинхронных HTTP-запросов
-# - Асинхронные GET/POST/PUT/DELETE запросы
-# - Поддержка сессий и connection pooling
-import aiohttp
-
 # Импорт аннотаций типов для Type Hinting
 # - Улучшение читаемости кода
 # - Возможность статической проверки типов (mypy)
@@ -28,6 +31,8 @@ from typing import Dict
 # - Удобные методы для манипуляции путями
 from pathlib import Path
 
+from app.http_session import HTTPSessionManager
+
 # Определение пути к файлу .env относительно расположения текущего скрипта
 env_path = Path(__file__).resolve().parent.parent / ".env"
 
@@ -37,12 +42,33 @@ load_dotenv(env_path)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Время жизни access-токена, если в нём нет поля exp (сек.)
+TOKEN_TTL = float(os.getenv("VALUEAI_TOKEN_TTL", "300"))
+# За сколько секунд до истечения токен считается устаревшим и обновляется заранее
+TOKEN_REFRESH_MARGIN = float(os.getenv("VALUEAI_TOKEN_REFRESH_MARGIN", "60"))
+# Сохранять ли полученные токены в .env (выполняется в фоне, вне пути запроса)
+PERSIST_TOKENS = os.getenv("VALUEAI_PERSIST_TOKENS", "true").lower() in ("1", "true", "yes")
+
+
+def _jwt_expiry(token: str | None) -> float | None:
+    """Возвращает время истечения JWT (поле exp, unix time) или None, если его нет"""
+    if not token:
+        return None
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)  # восстанавливаем выравнивание base64
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        # Токен не является JWT - срок жизни определим по TOKEN_TTL
+        return None
+
 
 # Определение класса, который содержит логику аутентификации на ValueAI и работы с токенами
 class AuthValuai:
 
     # Конструктор класса, инициализирует основные параметры
-    def __init__(self, login: str, password: str):
+    def __init__(self, login: str, password: str, http: HTTPSessionManager | None = None):
         # Сохраняем логин для доступа к API
         self.login = login
         # Сохраняем пароль для доступа к API
@@ -51,6 +77,73 @@ class AuthValuai:
         self.base_auth_url = "https://ml-request-prod.wavea.cc/api/external/v1/"
         # Путь к файлу .env (берется из внешней переменной env_path)
         self.env_path = env_path
+        # Общая HTTP-сессия (пул соединений), которую делим с ValueAIClient
+        self.http = http or HTTPSessionManager()
+
+        # Кэш токенов в памяти процесса: используется, пока access-токен не подходит к истечению
+        self.token_ttl = TOKEN_TTL
+        self.refresh_margin = TOKEN_REFRESH_MARGIN
+        self.persist_tokens = PERSIST_TOKENS
+        self._access_token = os.getenv("VALUEAI_ACCESS_TOKEN")
+        self._refresh_token = os.getenv("VALUEAI_REFRESH_TOKEN")
+        # Возраст токенов из .env неизвестен: без exp считаем их устаревшими и обновим при первом запросе
+        self._expires_at = _jwt_expiry(self._access_token) or 0.0
+
+        # Единственный выполняющийся запрос обновления (single-flight)
+        self._refresh_task: asyncio.Task | None = None
+        # Фоновая задача заблаговременного обновления токена
+        self._background_task: asyncio.Task | None = None
+        # Фоновые задачи записи токенов в .env
+        self._persist_tasks: set[asyncio.Task] = set()
+
+    async def start(self):
+        """Запускает фоновое обновление токена до истечения его срока"""
+        if self._background_task is None or self._background_task.done():
+            self._background_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        """Останавливает фоновое обновление и дожидается записи токенов на диск"""
+        if self._background_task is not None:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
+        if self._persist_tasks:
+            await asyncio.gather(*self._persist_tasks, return_exceptions=True)
+
+    def _token_is_fresh(self) -> bool:
+        return bool(self._access_token) and time.time() < self._expires_at - self.refresh_margin
+
+    def _store_tokens(self, tokens: Dict[str, str]) -> None:
+        """Кладёт новые токены в кэш и (при необходимости) сохраняет их в .env в фоне"""
+        self._access_token = tokens["authorization_token"]
+        self._refresh_token = tokens["refresh_token"]
+        self._expires_at = _jwt_expiry(self._access_token) or time.time() + self.token_ttl
+
+        if self.persist_tokens:
+            task = asyncio.create_task(self._persist(dict(tokens)))
+            self._persist_tasks.add(task)
+            task.add_done_callback(self._persist_tasks.discard)
+
+    async def _persist(self, tokens: Dict[str, str]) -> None:
+        try:
+            await self.update_env_tokens(tokens, self.env_path)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить токены в .env: {e}")
+
+    async def _refresh_loop(self):
+        """Обновляет токен заранее, чтобы запросы пользователей не ждали обновления"""
+        while True:
+            delay = max(self._expires_at - self.refresh_margin - time.time(), 1.0)
+            await asyncio.sleep(delay)
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.error(f"Фоновое обновление токена не удалось: {e}")
+                # Повторим попытку чуть позже, не забивая сервер запросами
+                await asyncio.sleep(5)
 
     # Статический метод для обновления токенов в .env файле
     @staticmethod
@@ -73,6 +166,15 @@ class AuthValuai:
             "VALUEAI_REFRESH_TOKEN": tokens["refresh_token"]
         }
 
+        # Работа с файлом выполняется в отдельном потоке, чтобы не блокировать event loop
+        await asyncio.to_thread(AuthValuai._write_env_file, env_updates, path_env)
+
+        # Обновляем переменные окружения в текущем процессе
+        os.environ.update(env_updates)
+
+    # Синхронная запись токенов в .env (вызывается из отдельного потока)
+    @staticmethod
+    def _write_env_file(env_updates: Dict[str, str], path_env: Path) -> None:
         # Проверка существования файла .env
         file_exists = path_env.exists()
         # Список для хранения строк файла
@@ -113,9 +215,6 @@ class AuthValuai:
                 # Формат: KEY=VALUE\n
                 f.write(f"{key}={value}\n")
 
-        # Обновляем переменные окружения в текущем процессе
-        os.environ.update(env_updates)
-
     # Метод для получения новых токенов по логину/паролю
     async def get_new_tokens(self) -> Dict[str, str]:
         # Отладочное сообщение
@@ -128,27 +227,27 @@ class AuthValuai:
         # Формируем URL для запроса токенов
         get_new_url = f"{self.base_auth_url}token"
 
-        # Создаем HTTP-сессию
-        async with aiohttp.ClientSession() as session:
-            # Отправляем POST-запрос
-            async with session.post(get_new_url, json=payload) as response:
-                # Выводим статус ответа для отладки
-                logger.debug(f'response.status = {response.status}')
-
-                # Обрабатываем возможные статусы ответа
-                if response.status == 400:
-                    raise Exception("Bad Request: Invalid headers")
-                elif response.status == 401:
-                    raise Exception("Not authorized: Invalid credentials")
-                elif response.status == 200:
-                    # При успехе парсим JSON ответа
-                    tokens = await response.json()
-                    # Обновляем токены в .env
-                    await self.update_env_tokens(tokens, self.env_path)
-                    # Возвращаем полученные токены
-                    return tokens
-                else:
-                    raise Exception("Unexpected server error")
+        # Берём общую HTTP-сессию (соединение к серверу уже может быть открыто)
+        session = self.http.session
+        # Отправляем POST-запрос
+        async with session.post(get_new_url, json=payload) as response:
+            # Выводим статус ответа для отладки
+            logger.debug(f'response.status = {response.status}')
+
+            # Обрабатываем возможные статусы ответа
+            if response.status == 400:
+                raise Exception("Bad Request: Invalid headers")
+            elif response.status == 401:
+                raise Exception("Not authorized: Invalid credentials")
+            elif response.status == 200:
+                # При успехе парсим JSON ответа
+                tokens = await response.json()
+                # Обновляем кэш токенов (запись в .env идёт в фоне)
+                self._store_tokens(tokens)
+                # Возвращаем полученные токены
+                return tokens
+            else:
+                raise Exception("Unexpected server error")
 
     # Метод для обновления токенов с помощью refresh_token
     async def refresh_tokens(self, refresh_token: str) -> Dict[str, str]:
@@ -162,42 +261,58 @@ class AuthValuai:
             "Authorization": f"Bearer {refresh_token}"
         }
 
-        # Создаем HTTP-сессию
-        async with aiohttp.ClientSession() as session:
-            # Отправляем POST-запрос для обновления
-            async with session.post(refresh_url, headers=headers) as response:
-                # Обрабатываем возможные статусы ответа
-                if response.status == 400:
-                    raise Exception("Bad Request: Invalid headers")
-                elif response.status == 401:
-                    raise Exception("Not authorized: Invalid refresh token")
-                elif response.status == 200:
-                    # При успехе парсим JSON ответа
-                    tokens = await response.json()
-                    # Обновляем токены в .env
-                    await self.update_env_tokens(tokens, self.env_path)
-                    # Возвращаем новые токены
-                    return tokens
+        # Берём общую HTTP-сессию
+        session = self.http.session
+        # Отправляем POST-запрос для обновления
+        async with session.post(refresh_url, headers=headers) as response:
+            # Обрабатываем возможные статусы ответа
+            if response.status == 400:
+                raise Exception("Bad Request: Invalid headers")
+            elif response.status == 401:
+                raise Exception("Not authorized: Invalid refresh token")
+            elif response.status == 200:
+                # При успехе парсим JSON ответа
+                tokens = await response.json()
+                # Обновляем кэш токенов (запись в .env идёт в фоне)
+                self._store_tokens(tokens)
+                # Возвращаем новые токены
+                return tokens
 
     # Основной метод для получения валидного токена
     async def get_valid_token(self) -> str:
-        # Отладочное сообщение
-
-        # Получаем текущие токены из переменных окружения
-        access_token = os.getenv("VALUEAI_ACCESS_TOKEN")
-        refresh_token = os.getenv("VALUEAI_REFRESH_TOKEN")
-
+        # Токен из кэша ещё действителен - сеть не нужна
+        if self._token_is_fresh():
+            return self._access_token
+        return await self._refresh()
+
+    async def renew_token(self, rejected: str) -> str:
+        """Сервер отклонил токен (401) раньше срока из кэша: сбрасываем срок и обновляем токен.
+        Если его уже обновил параллельный запрос - возвращаем новый без обращения к серверу"""
+        if rejected == self._access_token:
+            # access-токен оставляем: по нему _obtain_tokens выбирает обновление через refresh-токен
+            self._expires_at = 0.0
+            logger.warning("ValueAI отклонил access-токен, обновляем")
+        return await self.get_valid_token()
+
+    async def _refresh(self) -> str:
+        """Обновляет токены; параллельные вызовы ждут один общий запрос"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._obtain_tokens())
+        # shield: отмена одного ожидающего обработчика не отменяет общий запрос для остальных
+        return await asyncio.shield(self._refresh_task)
+
+    async def _obtain_tokens(self) -> str:
         # Если токены отсутствуют - получаем новые
-        if not access_token or not refresh_token:
+        if not self._access_token or not self._refresh_token:
             tokens = await self.get_new_tokens()
             return tokens["authorization_token"]
 
         # Пробуем обновить токены
         try:
-            new_tokens = await self.refresh_tokens(refresh_token)
+            new_tokens = await self.refresh_tokens(self._refresh_token)
             return new_tokens["authorization_token"]
-        except (aiohttp.ClientError, KeyError) as e:
-            # В случае ошибки - получаем новые токены
+        except Exception as e:
+            # В случае ошибки (в т.ч. истёкшего refresh-токена) - получаем новые токены
             # Логируем ошибку
             logging.error(f"Ошибка освежения токена: {e}", exc_info=True)
             # Параметр exc_info=True в методе logging.error()
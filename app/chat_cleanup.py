@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки фонового удаления чатов ValueAI (можно переопределить через .env)
+CHAT_CLEANUP_BATCH_SIZE = int(os.getenv("CHAT_CLEANUP_BATCH_SIZE", "20"))  # сколько чатов удалять за один проход
+CHAT_CLEANUP_MAX_ATTEMPTS = int(os.getenv("CHAT_CLEANUP_MAX_ATTEMPTS", "5"))  # попыток удалить один чат
+CHAT_CLEANUP_RETRY_DELAY = float(os.getenv("CHAT_CLEANUP_RETRY_DELAY", "2"))  # базовая пауза перед повтором, сек.
+CHAT_CLEANUP_DRAIN_TIMEOUT = float(os.getenv("CHAT_CLEANUP_DRAIN_TIMEOUT", "10"))  # ожидание очереди при остановке
+
+
+class ChatCleanupQueue:
+    """Фоновая очередь удаления чатов ValueAI: пользователь не ждёт DELETE /chat/{id}"""
+
+    def __init__(self, client,
+                 batch_size: int = CHAT_CLEANUP_BATCH_SIZE,
+                 max_attempts: int = CHAT_CLEANUP_MAX_ATTEMPTS,
+                 retry_delay: float = CHAT_CLEANUP_RETRY_DELAY):
+        # ValueAIClient: нужен для заголовков авторизации и общей HTTP-сессии
+        self.client = client
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: asyncio.Task | None = None
+        # Отложенные повторы (handle от loop.call_later), чтобы отменить их при остановке
+        self._retries: set[asyncio.TimerHandle] = set()
+        self.deleted = 0
+        self.failed = 0
+
+    def schedule(self, chat_url: str, attempt: int = 0):
+        """Ставит чат в очередь на удаление (не блокирует вызывающего)"""
+        self._queue.put_nowait((chat_url, attempt))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Дожидается удаления уже поставленных в очередь чатов и останавливает воркер"""
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=CHAT_CLEANUP_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не все чаты удалены при остановке: в очереди {self._queue.qsize()}")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def _retry_later(self, chat_url: str, attempt: int):
+        loop = asyncio.get_running_loop()
+        handle = None
+
+        def requeue():
+            self._retries.discard(handle)
+            self.schedule(chat_url, attempt)
+
+        # Экспоненциальная пауза между попытками
+        handle = loop.call_later(self.retry_delay * 2 ** (attempt - 1), requeue)
+        self._retries.add(handle)
+
+    async def _delete(self, chat_url: str, headers: dict):
+        async with self.client.http.session.delete(chat_url, headers=headers) as response:
+            status = response.status
+        if status == 401:
+            # Токен отклонён раньше срока из кэша - обновляем его и повторяем удаление один раз
+            headers = await self.client.reauthorize(headers)
+            async with self.client.http.session.delete(chat_url, headers=headers) as response:
+                status = response.status
+        # 404 - чат уже удалён, повторять нечего
+        if status not in (200, 404):
+            raise RuntimeError(f"статус {status}")
+
+    async def _run(self):
+        while True:
+            # Ждём первый чат, затем добираем всё, что уже накопилось, в одну пачку
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                headers = await self.client.get_headers()
+                results = await asyncio.gather(
+                    *(self._delete(chat_url, headers) for chat_url, _ in batch),
+                    return_exceptions=True
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (chat_url, attempt), result in zip(batch, results):
+                if not isinstance(result, Exception):
+                    self.deleted += 1
+                elif attempt + 1 < self.max_attempts:
+                    logger.warning(f"Ошибка удаления чата {chat_url} ({result}), повторим позже")
+                    self._retry_later(chat_url, attempt + 1)
+                else:
+                    self.failed += 1
+                    logger.error(f"Не удалось удалить чат {chat_url}: {result}")
+                self._queue.task_done()
+            logger.debug(f"Удалено чатов ValueAI: {self.deleted}, не удалось: {self.failed}")
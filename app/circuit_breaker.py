@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки автомата защиты запросов к ValueAI (можно переопределить через .env)
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "60"))  # за сколько последних секунд считать ошибки
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))  # меньше запросов в окне - не размыкаемся
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))  # доля неудачных, при которой размыкаемся
+# Запрос дольше этого считается неудачным: ValueAI «висит», даже если в итоге отвечает
+CIRCUIT_SLOW_CALL = float(os.getenv("CIRCUIT_SLOW_CALL", "20"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))  # сколько не обращаться к сервису
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))  # пробных запросов после паузы
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ServiceDegraded(Exception):
+    """Сервис признан недоступным, запрос к нему не выполнялся"""
+    pass
+
+
+class CircuitBreaker:
+    """Автомат защиты: после серии ошибок (или слишком медленных ответов) перестаёт обращаться
+    к сервису на open_seconds, затем пропускает пробные запросы и по их итогу замыкается обратно"""
+
+    def __init__(self,
+                 name: str,
+                 window: float = CIRCUIT_WINDOW,
+                 min_calls: int = CIRCUIT_MIN_CALLS,
+                 failure_rate: float = CIRCUIT_FAILURE_RATE,
+                 slow_call: float = CIRCUIT_SLOW_CALL,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 half_open_calls: int = CIRCUIT_HALF_OPEN_CALLS,
+                 is_failure=None):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        # is_failure(ошибка) -> False: ошибка не про здоровье сервиса (например, отказ в доступе)
+        self.is_failure = is_failure
+        self.state = CLOSED
+        # Итоги запросов в окне: (момент завершения, успешен ли)
+        self._calls: deque[tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probes = 0  # пробных запросов выполняется сейчас
+        self._probe_successes = 0
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def retry_in(self) -> float:
+        """Через сколько секунд будет пробный запрос (0 - если автомат не разомкнут)"""
+        if self.state != OPEN:
+            return 0.0
+        return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def available(self) -> bool:
+        """Можно ли сейчас обращаться к сервису (без учёта лимита пробных запросов)"""
+        if self.state == OPEN and not self.retry_in:
+            self._transition(HALF_OPEN)
+        return self.state != OPEN
+
+    def _acquire(self):
+        if not self.available() or (self.state == HALF_OPEN and self._probes >= self.half_open_calls):
+            self.rejected += 1
+            raise ServiceDegraded(f"{self.name}: автомат разомкнут, повтор через {self.retry_in:.0f} сек.")
+        if self.state == HALF_OPEN:
+            self._probes += 1
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"{self.name}: {self.state} -> {state}")
+        self.state = state
+        self._probes = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.trips += 1
+        self._calls.clear()
+
+    def _record(self, success: bool, probe: bool):
+        now = time.monotonic()
+        if probe:
+            self._probes -= 1
+            if self.state != HALF_OPEN:
+                return  # исход другого пробного запроса уже решил судьбу автомата
+            if not success:
+                self._transition(OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CLOSED)
+            return
+
+        self._calls.append((now, success))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+        if self.state == CLOSED and len(self._calls) >= self.min_calls:
+            failures = sum(1 for _, ok in self._calls if not ok)
+            if failures / len(self._calls) >= self.failure_rate:
+                self._transition(OPEN)
+
+    async def call(self, func, *args, **kwargs):
+        """Выполняет await func(...) через автомат; при разомкнутом автомате - ServiceDegraded сразу"""
+        self._acquire()
+        probe = self.state == HALF_OPEN
+        start = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Отменённый запрос (ответ больше не нужен) ничего не говорит о здоровье сервиса
+            if probe:
+                self._probes -= 1
+            raise
+        except Exception as e:
+            if self.is_failure is not None and not self.is_failure(e):
+                if probe:
+                    self._probes -= 1
+                raise
+            self._record(False, probe)
+            raise
+        self._record(time.monotonic() - start < self.slow_call, probe)
+        return result
+
+    def stats(self) -> dict:
+        failures = sum(1 for _, ok in self._calls if not ok)
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "failure_rate": failures / len(self._calls) if self._calls else 0.0,
+            "retry_in": self.retry_in,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
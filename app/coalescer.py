@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Сколько ждать следующего сообщения пользователя, прежде чем отправлять вопрос (мс).
+# Telegram делит длинный текст на несколько сообщений, они приходят почти одновременно
+QUESTION_DEBOUNCE_MS = int(os.getenv("QUESTION_DEBOUNCE_MS", "500"))
+
+
+class _Pending:
+    __slots__ = ("texts", "version")
+
+    def __init__(self):
+        self.texts: list[str] = []
+        self.version = 0
+
+
+class QuestionCoalescer:
+    """Склеивает идущие подряд сообщения пользователя в один вопрос и отменяет
+    запрос к LLM, ответ на который уже не нужен (пользователь прислал новое сообщение)"""
+
+    def __init__(self, debounce_ms: int = QUESTION_DEBOUNCE_MS):
+        self.window = debounce_ms / 1000
+        # user_id -> сообщения, ожидающие окончания окна
+        self._pending: dict[int, _Pending] = {}
+        # user_id -> future выполняющегося запроса к LLM
+        self._active: dict[int, asyncio.Future] = {}
+        self.merged = 0
+        self.superseded = 0
+
+    async def collect(self, user_id: int, text: str) -> str | None:
+        """Возвращает объединённый вопрос, если за окно не пришло новых сообщений,
+        иначе None - сообщение войдёт в вопрос, который отправит следующий вызов"""
+        if not text:
+            return None  # не текст (стикер, фото) - в вопрос не склеивается и запрос не отменяет
+        active = self._active.pop(user_id, None)
+        if active is not None and not active.done():
+            active.cancel()
+            self.superseded += 1
+
+        entry = self._pending.get(user_id)
+        if entry is None:
+            entry = self._pending[user_id] = _Pending()
+        else:
+            self.merged += 1
+        entry.texts.append(text)
+        entry.version += 1
+        version = entry.version
+
+        try:
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+        finally:
+            # Запись принадлежит последнему сообщению: убираем её и тогда, когда обработчик отменён
+            if entry.version == version and self._pending.get(user_id) is entry:
+                del self._pending[user_id]
+        if entry.version != version:
+            return None
+        return "\n".join(entry.texts)
+
+    def attach(self, user_id: int, future: asyncio.Future):
+        """Запоминает запрос пользователя: следующее его сообщение этот запрос отменит"""
+        self._active[user_id] = future
+
+        def forget(done: asyncio.Future):
+            if self._active.get(user_id) is done:
+                del self._active[user_id]
+
+        future.add_done_callback(forget)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "active": len(self._active),
+            "merged": self.merged,
+            "superseded": self.superseded,
+        }
@@ -1,5 +1,8 @@
+import asyncio
 import logging
 import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 import os
 from dotenv import load_dotenv
@@ -10,26 +13,179 @@ mail_key = os.getenv("MAIL_KEY")
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Настройки отправителя (по умолчанию mail.ru; для локальной проверки - любой SMTP-сервер без SSL)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.mail.ru")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))  # таймаут сетевых операций SMTP, сек.
+MAIL_SENDER = os.getenv("MAIL_SENDER", "daniilkondratuk@mail.ru")
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "3"))  # попыток доставить одно письмо
+MAIL_RETRY_DELAY = float(os.getenv("MAIL_RETRY_DELAY", "1"))  # базовая пауза перед повтором, сек.
+MAIL_NOOP_AFTER = float(os.getenv("MAIL_NOOP_AFTER", "30"))  # после такого простоя соединение проверяется NOOP
+MAIL_DRAIN_TIMEOUT = float(os.getenv("MAIL_DRAIN_TIMEOUT", "10"))  # ожидание очереди при остановке, сек.
 
-def send_key_to_email(user_mail: str, pass_key: str):
-    # Настройки отправителя (mail.ru)
-    sender_email = "daniilkondratuk@mail.ru"
-    password = mail_key  # пароль для приложений
-    receiver_email = user_mail  # Куда отправляем
+# Ошибки, при которых повтор не поможет (адрес отклонён, неверный пароль приложения)
+_PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError)
 
-    # Создаем сообщение
+
+def build_key_message(user_mail: str, pass_key: str) -> MIMEText:
     message = MIMEText(f"Привет! Вот твой одноразовый код для входа в систему бота: {pass_key}\n\n"
                        f"Компания WaveAccess | Разработка программного ПО на заказ")
     message["Subject"] = "Авторизация HR-chatbot WaveAccess."
-    message["From"] = sender_email
-    message["To"] = receiver_email
-
-    # Отправка через SMTP mail.ru
-    try:
-        # Подключаемся к серверу mail.ru (используем порт 465 с SSL)
-        with smtplib.SMTP_SSL("smtp.mail.ru", 465) as server:
-            server.login(sender_email, password)
-            server.sendmail(sender_email, receiver_email, message.as_string())
-        logger.info("✅ Письмо успешно отправлено!")
-    except Exception as e:
-        logger.error(f"❌ Ошибка отправка письма: {e}")
+    message["From"] = MAIL_SENDER
+    message["To"] = user_mail
+    return message
+
+
+class EmailSender:
+    """Очередь писем с одним постоянным SMTP-соединением: обработчики не блокируют event loop"""
+
+    def __init__(self,
+                 host: str = SMTP_HOST,
+                 port: int = SMTP_PORT,
+                 use_ssl: bool = SMTP_USE_SSL,
+                 sender: str = MAIL_SENDER,
+                 password: str | None = mail_key,
+                 max_attempts: int = MAIL_MAX_ATTEMPTS,
+                 retry_delay: float = MAIL_RETRY_DELAY):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.sender = sender
+        self.password = password
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: asyncio.Task | None = None
+        self._retries: set[asyncio.TimerHandle] = set()
+        # smtplib блокирующий: соединение живёт и используется только в одном отдельном потоке
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+        self._smtp: smtplib.SMTP | None = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    def send(self, message: MIMEText) -> asyncio.Future:
+        """Ставит письмо в очередь; future получит True (доставлено) или False (не удалось)"""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(message, future, 0)
+        return future
+
+    def send_key(self, user_mail: str, pass_key: str) -> asyncio.Future:
+        return self.send(build_key_message(user_mail, pass_key))
+
+    def _enqueue(self, message: MIMEText, future: asyncio.Future, attempt: int):
+        self._queue.put_nowait((message, future, attempt))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Дожидается отправки уже поставленных писем, закрывает SMTP-соединение"""
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=MAIL_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Не все письма отправлены при остановке: в очереди {self._queue.qsize()}")
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=True)
+
+    # --- работа с SMTP (выполняется в потоке self._executor) ---
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            if self.password:
+                smtp.login(self.sender, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.reconnects += 1
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+    def _alive(self) -> bool:
+        if self._smtp is None:
+            return False
+        if time.monotonic() - self._last_used < MAIL_NOOP_AFTER:
+            return True
+        # Сервер мог закрыть простаивающее соединение - проверяем перед отправкой
+        try:
+            return self._smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def _deliver(self, message: MIMEText):
+        if not self._alive():
+            self._disconnect()
+            self._connect()
+        try:
+            self._smtp.sendmail(self.sender, message["To"], message.as_string())
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Соединение оборвалось на отправке - следующая попытка откроет новое
+            self._smtp.close()
+            self._smtp = None
+            raise
+        self._last_used = time.monotonic()
+
+    # --- очередь (event loop) ---
+
+    def _retry_later(self, message: MIMEText, future: asyncio.Future, attempt: int):
+        loop = asyncio.get_running_loop()
+        handle = None
+
+        def requeue():
+            self._retries.discard(handle)
+            self._enqueue(message, future, attempt)
+
+        # Экспоненциальная пауза между попытками
+        handle = loop.call_later(self.retry_delay * 2 ** (attempt - 1), requeue)
+        self._retries.add(handle)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message, future, attempt = await self._queue.get()
+            try:
+                await loop.run_in_executor(self._executor, self._deliver, message)
+                self.sent += 1
+                logger.info(f"✅ Письмо для {message['To']} успешно отправлено!")
+                if not future.done():
+                    future.set_result(True)
+            except Exception as e:
+                if not isinstance(e, _PERMANENT_ERRORS) and attempt + 1 < self.max_attempts:
+                    logger.warning(f"Ошибка отправки письма для {message['To']} ({e}), повторим позже")
+                    self._retry_later(message, future, attempt + 1)
+                else:
+                    self.failed += 1
+                    logger.error(f"❌ Ошибка отправка письма: {e}")
+                    if not future.done():
+                        future.set_result(False)
+            finally:
+                self._queue.task_done()
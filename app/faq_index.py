@@ -0,0 +1,162 @@
+import logging
+import math
+import os
+import zlib
+from collections import Counter
+
+# NumPy - векторные операции над матрицей признаков вопросов
+import numpy as np
+from dotenv import load_dotenv
+
+from app.answer_cache import normalize_question
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Порог косинусной близости, начиная с которого отвечаем без обращения к LLM
+FAQ_SIMILARITY_THRESHOLD = float(os.getenv("FAQ_SIMILARITY_THRESHOLD", "0.85"))
+# Порог, когда ValueAI недоступен: лучше ответ на похожий вопрос, чем никакого
+FAQ_DEGRADED_THRESHOLD = float(os.getenv("FAQ_DEGRADED_THRESHOLD", "0.6"))
+# Сколько последних вопросов из statistics_table загружать при старте
+FAQ_MAX_QUESTIONS = int(os.getenv("FAQ_MAX_QUESTIONS", "5000"))
+# Сколько самых старых вопросов вытеснять разом, когда индекс заполнен (доля от max_questions)
+FAQ_EVICT_FRACTION = 0.1
+# Размерность пространства признаков (n-граммы хэшируются в него)
+FAQ_FEATURES = 1 << 18
+# Длины символьных n-грамм
+FAQ_NGRAM_RANGE = (2, 4)
+
+
+def _features(text: str) -> Counter:
+    """Символьные n-граммы вопроса (с границами слов), захэшированные в индексы признаков"""
+    counts = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for n in range(FAQ_NGRAM_RANGE[0], FAQ_NGRAM_RANGE[1] + 1):
+            for i in range(len(padded) - n + 1):
+                counts[zlib.crc32(padded[i:i + n].encode()) % FAQ_FEATURES] += 1
+    return counts
+
+
+class FAQIndex:
+    """TF-IDF индекс (символьные n-граммы) по вопросам, на которые LLM уже ответила"""
+
+    def __init__(self, threshold: float = FAQ_SIMILARITY_THRESHOLD, max_questions: int = FAQ_MAX_QUESTIONS):
+        self.threshold = threshold
+        self.max_questions = max_questions
+        # Нормализованный вопрос -> номер строки (повторы не раздувают индекс)
+        self._rows: dict[str, int] = {}
+        self._questions: list[str] = []
+        self._answers: list[str] = []
+        # Разреженная матрица tf в формате CSR, накапливается построчно
+        self._indices: list[np.ndarray] = []
+        self._values: list[np.ndarray] = []
+        # Документная частота каждого признака (для idf)
+        self._df = np.zeros(FAQ_FEATURES, dtype=np.int32)
+        # Собранная матрица; пересобирается лениво после добавления вопросов
+        self._matrix = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._answers)
+
+    def add(self, question: str, answer: str):
+        """Добавляет (или обновляет ответ) вопрос в индекс"""
+        key = normalize_question(question)
+        if not key or not answer:
+            return
+        row = self._rows.get(key)
+        if row is not None:
+            # Вопрос уже есть - храним самый свежий ответ
+            self._answers[row] = answer
+            return
+        counts = _features(key)
+        if not counts:
+            return
+        if len(self._answers) >= self.max_questions:
+            # Вытесняем пачкой: перестройка списков и матрицы не на каждый новый вопрос
+            self._evict(max(1, int(self.max_questions * FAQ_EVICT_FRACTION)))
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        # Сублинейный tf: частые n-граммы не доминируют над редкими
+        values = np.fromiter((1.0 + math.log(c) for c in counts.values()), dtype=np.float32, count=len(counts))
+
+        self._rows[key] = len(self._answers)
+        self._questions.append(question)
+        self._answers.append(answer)
+        self._indices.append(indices)
+        self._values.append(values)
+        self._df[indices] += 1
+        self._matrix = None
+
+    def _evict(self, count: int):
+        """Удаляет count самых старых вопросов (первые добавленные)"""
+        for indices in self._indices[:count]:
+            self._df[indices] -= 1
+        del self._questions[:count], self._answers[:count], self._indices[:count], self._values[:count]
+        self._rows = {key: row - count for key, row in self._rows.items() if row >= count}
+        self._matrix = None
+        logger.info(f"FAQ-индекс заполнен ({self.max_questions} вопросов): вытеснено {count} самых старых")
+
+    def _build(self):
+        """Склеивает строки в CSR-массивы и считает нормы строк с текущими idf"""
+        n_docs = len(self._answers)
+        idf = (np.log((1 + n_docs) / (1 + self._df)) + 1.0).astype(np.float32)
+        indices = np.concatenate(self._indices)
+        lengths = np.fromiter((len(i) for i in self._indices), dtype=np.int64, count=n_docs)
+        indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        weights = np.concatenate(self._values) * idf[indices]
+        norms = np.sqrt(np.add.reduceat(weights * weights, indptr[:-1]))
+        self._matrix = (idf, indices, indptr, weights / np.repeat(norms, lengths))
+
+    def search(self, question: str, threshold: float | None = None) -> tuple[str, float] | None:
+        """Возвращает (ответ, близость) для самого похожего вопроса, если близость выше порога"""
+        threshold = self.threshold if threshold is None else threshold
+        key = normalize_question(question)
+        counts = _features(key) if key else None
+        if not counts or not self._answers:
+            self.misses += 1
+            return None
+        if self._matrix is None:
+            self._build()
+        idf, indices, indptr, weights = self._matrix
+
+        # Вектор запроса в том же пространстве признаков
+        query = np.zeros(FAQ_FEATURES, dtype=np.float32)
+        q_idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        query[q_idx] = np.fromiter((1.0 + math.log(c) for c in counts.values()), dtype=np.float32,
+                                   count=len(counts)) * idf[q_idx]
+        q_norm = np.linalg.norm(query)
+        if q_norm == 0:
+            self.misses += 1
+            return None
+
+        # Косинусная близость запроса со всеми строками разом
+        scores = np.add.reduceat(weights * query[indices], indptr[:-1]) / q_norm
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score < threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info(f"FAQ: найден похожий вопрос «{self._questions[best]}» (близость {score:.2f})")
+        return self._answers[best], score
+
+    async def load(self, db):
+        """Строит индекс по ответам из statistics_table (сохраняются только ответы с кодом 200)"""
+        rows = await db.fetch_answered_questions(self.max_questions)
+        for question, answer in rows:
+            self.add(question, answer)
+        logger.info(f"FAQ-индекс построен: {len(self)} уникальных вопросов")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "questions": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
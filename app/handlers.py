@@ -12,9 +12,14 @@ from dotenv import load_dotenv  # загрузка переменных из .en
 import app.keyboards as kb  # Локальный модуль с клавиатурами
 from app.valueai_client import ValueAIClient  # Кастомный клиент для работы с внешним API
 from app.auth_valueai import AuthValuai  # Модуль для управления аутентификацией (получение/обновление auth-token)
-from config import FSM_DB_PATH
-from app.sqlite_storage import SQLiteStorage
-from app.email_key import send_key_to_email
+from app.http_session import HTTPSessionManager  # Общий пул HTTP-соединений к ValueAI
+from app.faq_index import FAQIndex, FAQ_DEGRADED_THRESHOLD  # Поиск ответов на похожие (уже заданные) вопросы
+from app.circuit_breaker import ServiceDegraded  # ValueAI признан недоступным
+from app.email_key import EmailSender  # Фоновая отправка писем с одноразовыми кодами
+from app.outbound import OutboundScheduler, notification_priority  # Очередь исходящих сообщений в Telegram
+from app.llm_scheduler import LLMScheduler, LLMQueueFull  # Ограничение одновременных запросов к LLM
+from app.coalescer import QuestionCoalescer  # Склейка сообщений подряд и отмена устаревших запросов
+from app.states import UserStates, AdminStates  # Состояния FSM пользователя и администратора
 
 from aiogram import F, Router
 from aiogram.fsm.storage.base import StorageKey
@@ -27,15 +32,16 @@ from aiogram.types import Message, CallbackQuery
 # Command - фильтр для любых команд (например, Command("help"))
 from aiogram.filters import CommandStart, Command
 
-from aiogram.fsm.state import State, StatesGroup
-
 # FSMContext - управление состоянием пользователя (установка/получение данных)
 from aiogram.fsm.context import FSMContext
 from app.issue_statistics import Database
 
 # Работа с датой/временем
 from datetime import datetime
+from functools import partial
 
+import io
+import re
 import secrets
 import string
 
@@ -51,28 +57,35 @@ VALUEAI_PASSWORD = os.getenv("VALUEAI_PASSWORD")  # Пароль для ауте
 
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS").split(",")))
 
+# Максимальный размер файла со списком логинов для массового добавления, байт
+IMPORT_MAX_FILE_SIZE = int(os.getenv("IMPORT_MAX_FILE_SIZE", str(5 * 1024 * 1024)))
+LOGIN_PATTERN = re.compile(r"[^\s@,;]+@waveaccess\.global")
+# Разделители столбцов CSV (Excel в русской локали сохраняет через ";")
+CSV_SEPARATOR = re.compile(r"[,;\t]")
+
+# Общая HTTP-сессия для всех запросов к ValueAI (создаётся и закрывается в main.main())
+http_session = HTTPSessionManager()
+
 # Создаем менеджер аутентификации, передавая ему полученные учетные данные
-auth_manager = AuthValuai(VALUEAI_LOGIN, VALUEAI_PASSWORD)
+auth_manager = AuthValuai(VALUEAI_LOGIN, VALUEAI_PASSWORD, http_session)
 
 # Инициализируем клиент для работы с API ValueAI, передавая ему менеджер аутентификации
-valueai_client = ValueAIClient(auth_manager)
+valueai_client = ValueAIClient(auth_manager, http_session)
 
+# Индекс уже отвеченных вопросов: строится из statistics_table в main.main()
+faq_index = FAQIndex()
 
-# Устанавливаем кастомные состояния
-class UserStates(StatesGroup):
-    start = State()
-    login = State()  # Ввод логина
-    password = State()  # Ввод пароля
-    auth_confirmed = State()  # Успешная авторизация
-    banned = State()  # Пользователь больше не авторизован
+# Очередь писем с постоянным SMTP-соединением (закрывается в main.main())
+email_sender = EmailSender()
 
+# Очередь вопросов к LLM: не больше LLM_MAX_IN_FLIGHT запросов к ValueAI одновременно
+llm_scheduler = LLMScheduler()
 
-# Состояния для админа (добавление/удаление пользователя)
-class AdminStates(StatesGroup):
-    login = State()
-    admin = State()
-    waiting_for_new_user = State()
-    waiting_for_user_to_remove = State()
+# Сообщения, присланные подряд, становятся одним вопросом; новое сообщение отменяет ещё не полученный ответ
+coalescer = QuestionCoalescer()
+
+# Все исходящие запросы бота проходят через планировщик с лимитами Telegram (подключается в main.main())
+outbound = OutboundScheduler()
 
 
 # 1. Стартовые команды:
@@ -110,13 +123,81 @@ async def admin_panel(message: Message, state: FSMContext):
         await message.answer("Недостаточно прав!")
 
 
+# Обработчик команды /flush_cache (только для админа) - сбрасывает кэш ответов LLM
+@router.message(Command("flush_cache"))
+async def flush_answer_cache(message: Message, state: FSMContext):
+    data = await state.get_data()
+    if data.get('is_admin') != "true":
+        await message.answer("Недостаточно прав!")
+        return
+
+    stats = valueai_client.cache.stats()
+    removed = valueai_client.cache.clear()
+    await message.answer(
+        f"🧹 Кэш ответов очищен, удалено записей: {removed}\n"
+        f"Попаданий: {stats['hits']}, промахов: {stats['misses']} "
+        f"(hit rate {stats['hit_rate'] * 100:.1f}%)"
+    )
+
+
+# Обработчик команды /status (только для админа) - метрики кэшей бота
+@router.message(Command("status"))
+async def show_status(message: Message, state: FSMContext, auth_bot: Database):
+    data = await state.get_data()
+    if data.get('is_admin') != "true":
+        await message.answer("Недостаточно прав!")
+        return
+
+    answers = valueai_client.cache.stats()
+    faq = faq_index.stats()
+    auth = auth_bot.auth_cache.stats()
+    queue = outbound.stats()
+    llm = llm_scheduler.stats()
+    merged = coalescer.stats()
+    breaker = valueai_client.breaker.stats()
+    hedging = valueai_client.hedger.stats()
+    polling = valueai_client.poller.stats()
+    statistics = auth_bot.statistics_writer.stats()
+    if hedging['enabled']:
+        delays = ", ".join(f"{stage} {delay:.1f} сек." for stage, delay in hedging['delays'].items() if delay)
+        hedging_state = (f"дублей {hedging['hedged']}, из них быстрее основного {hedging['hedge_wins']}"
+                         f"{f' (порог: {delays})' if delays else ''}")
+    else:
+        hedging_state = "выключено"
+    breaker_state = {"closed": "работает", "open": "недоступен", "half_open": "пробный запрос"}[breaker['state']]
+    if breaker['retry_in']:
+        breaker_state += f", повтор через {breaker['retry_in']:.0f} сек."
+    await message.answer(
+        f"📊 Состояние бота\n\n"
+        f"Кэш ответов: {answers['entries']} записей, hit rate {answers['hit_rate'] * 100:.1f}%\n"
+        f"FAQ-индекс: {faq['questions']} вопросов, hit rate {faq['hit_rate'] * 100:.1f}%\n"
+        f"Кэш авторизации: {auth['entries']} записей, hit rate {auth['hit_rate'] * 100:.1f}% "
+        f"(попаданий {auth['hits']}, промахов {auth['misses']}, сбросов {auth['invalidations']})\n"
+        f"Запросы к LLM: выполняется {llm['in_flight']} из {llm['max_in_flight']}, в очереди {llm['queued']}, "
+        f"отклонено {llm['rejected']}, склеено сообщений {merged['merged']}, "
+        f"отменено устаревших запросов {merged['superseded']}\n"
+        f"ValueAI: {breaker_state} (ошибок за окно {breaker['failure_rate'] * 100:.0f}% из {breaker['calls']}, "
+        f"отключений {breaker['trips']}, отклонено запросов {breaker['rejected']})\n"
+        f"Ожидание ответа ValueAI: медиана {polling['p50']:.1f} сек., p90 {polling['p90']:.1f} сек., "
+        f"опросов на ответ {polling['avg_polls']:.1f} (ответов {polling['answers']})\n"
+        f"Дублирование медленных запросов: {hedging_state}\n"
+        f"Очередь отправки: {queue['depth']} (ответы {queue['interactive']}, уведомления {queue['notifications']}), "
+        f"максимум {queue['max_depth']}, отправлено {queue['sent']}, повторов после 429: {queue['retried']}\n"
+        f"Статистика: записано {statistics['written']}, отброшено {statistics['dropped']}, "
+        f"ждёт записи {statistics['queued']}"
+    )
+
+
 # 2. Основные callback-запросы:
 # Обработчик нажатия на кнопку с callback_data "about_us"
 @router.callback_query(F.data == "komands")
 async def about_us(callback: CallbackQuery):
     await callback.message.edit_text("/start - команда заново запускает авторизацию в системе\n\n"
                                      "/menu - команда открывает предыдущее меню\n\n"
-                                     "/admin - команда открывает кнопки админа", reply_markup=kb.kb_comands)
+                                     "/admin - команда открывает кнопки админа\n\n"
+                                     "/flush_cache - команда очищает кэш ответов (для админа)\n\n"
+                                     "/status - команда показывает состояние кэшей и очереди отправки (для админа)",
+                                     reply_markup=kb.kb_comands)
 
 
 @router.callback_query(F.data == "close_main_kb")
@@ -192,7 +273,11 @@ async def process_login(message: Message, state: FSMContext, auth_bot: Database)
     await state.set_state(UserStates.password)
     # print("До get_data в password после смены состояния:", await state.get_data())
 
-    send_key_to_email(message.text, p_key)
+    # Письмо отправляется в фоне; ждём только статус доставки, event loop не блокируется
+    if not await email_sender.send_key(message.text, p_key):
+        await state.set_state(UserStates.login)
+        await message.answer("Не удалось отправить код на почту. Попробуйте ввести логин ещё раз позже")
+        return
 
     # Отправляем пользователю сообщение с инструкцией
     await message.answer("Отлично! Мы отправили вам на почту одноразовый 10-значный код, скопируйте и вставьте сюда")
@@ -299,30 +384,83 @@ async def process_user_removal(message: Message, state: FSMContext, auth_bot: Da
     login = message.text.strip()
 
     # Пытаемся удалить пользователя из БД доступа
-    remove_data = await auth_bot.delete_login_with_tg_ids(login)  # Эта функция возвращает список tg id для блокировки
-
     try:
-        for _id in remove_data:
-            await message.bot.send_message(_id, "❌ Ваш доступ был отозван. Вы больше не "
-                                                "можете пользоваться ботом")
-            await message.bot.send_message(_id, "Для разблокировки нажмите команду /start и попробуйте "
-                                                "заново авторизоваться или обратитесь к администратору")
-
-            storage = SQLiteStorage(db_path=FSM_DB_PATH)
-            context = FSMContext(storage, StorageKey(chat_id=_id, user_id=_id, bot_id=message.bot.id))
-            await context.set_data({})
-            await context.set_state(UserStates.banned)
-
+        remove_data = await auth_bot.delete_login_with_tg_ids(login)  # Эта функция возвращает список tg id для блокировки
+        # Используем общее хранилище диспетчера (одно постоянное соединение с SQLite)
+        sent, failed = await revoke_access(message.bot, state.storage, remove_data)
     except Exception as e:
         await message.answer(f"⚠ Не удалось удалить пользователя: {e}")
         logger.error(f"⚠ Не удалось удалить пользователя: {e}")
+    else:
+        await message.answer(f"✅ Пользователь \"{login}\" удалён\n"
+                             f"Отозвано сессий: {len(remove_data)}, уведомлено: {sent}, не доставлено: {failed}")
 
-    await message.answer(f"✅ Пользователь \"{login}\" удалён")
+    await message.answer("Готов отвечать на ваши вопросы!")
+    await state.set_state(AdminStates.admin)
+
+
+# Нажатие кнопки "Загрузить список пользователей"
+@router.callback_query(F.data == "admin_import_users")
+async def start_importing_users(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if data.get('is_admin') == "true":
+        await callback.message.edit_text("Отправьте файл CSV/TXT с логинами (по одному в строке или в первом "
+                                         "столбце) в формате name@waveaccess.global:")
+        await state.set_state(AdminStates.waiting_for_user_file)
+        await callback.answer()
+    else:
+        await callback.answer("Недостаточно прав!")
+
+
+# Логины из файла читаются построчно; некорректные строки только подсчитываются
+def read_logins(lines, counters: dict):
+    seen = set()
+    for line in lines:
+        cell = CSV_SEPARATOR.split(line, 1)[0].strip().strip('"')
+        if not cell or cell.lower() == "login":
+            continue  # пустая строка или заголовок
+        if not LOGIN_PATTERN.fullmatch(cell):
+            counters['invalid'] += 1
+            continue
+        if cell in seen:
+            counters['repeated'] += 1
+            continue
+        seen.add(cell)
+        yield cell
+
+
+@router.message(AdminStates.waiting_for_user_file, F.document)
+async def handle_admin_import_users(message: Message, state: FSMContext, auth_bot: Database):
+    if message.document.file_size and message.document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.answer(f"Файл слишком большой (максимум {IMPORT_MAX_FILE_SIZE // 1024} КБ)")
+        return
+
+    buffer = io.BytesIO()
+    await message.bot.download(message.document, destination=buffer)
+    buffer.seek(0)
+    counters = {'invalid': 0, 'repeated': 0}
+    lines = io.TextIOWrapper(buffer, encoding="utf-8-sig", errors="replace", newline="")
+
+    try:
+        added, existing = await auth_bot.import_logins(read_logins(lines, counters))
+        await message.answer(f"✅ Загрузка завершена\n"
+                             f"Добавлено: {added}\n"
+                             f"Уже были в базе: {existing}\n"
+                             f"Повторы в файле: {counters['repeated']}\n"
+                             f"Некорректных строк: {counters['invalid']}")
+    except Exception as e:
+        await message.answer(f"⚠ Не удалось загрузить пользователей: {e}")
+        logger.error(f'Ошибка массового добавления пользователей: {e}')
 
     await message.answer("Готов отвечать на ваши вопросы!")
     await state.set_state(AdminStates.admin)
 
 
+@router.message(AdminStates.waiting_for_user_file)
+async def handle_admin_import_not_file(message: Message):
+    await message.answer("Отправьте список логинов файлом (CSV или TXT)")
+
+
 @router.callback_query(F.data == "close_admin_kb")
 async def start_removing_user(callback: CallbackQuery):
     try:
@@ -336,15 +474,69 @@ async def start_removing_user(callback: CallbackQuery):
     await callback.answer("Клавиатура скрыта")
 
 
+# Переводит пользователя в состояние banned и очищает его данные FSM
+async def ban_user(storage, bot_id: int, tg_id: int):
+    context = FSMContext(storage, StorageKey(chat_id=tg_id, user_id=tg_id, bot_id=bot_id))
+    await context.set_data({})
+    await context.set_state(UserStates.banned)
+
+
+# Отзывает доступ у всех tg_id разом: FSM обновляется одной транзакцией, уведомления
+# рассылаются параллельно в пределах лимита Telegram. Возвращает (доставлено, не доставлено)
+async def revoke_access(bot, storage, tg_ids: list[int]) -> tuple[int, int]:
+    if not tg_ids:
+        return 0, 0
+    keys = [StorageKey(chat_id=_id, user_id=_id, bot_id=bot.id) for _id in tg_ids]
+    await storage.bulk_set(keys, UserStates.banned, {})
+
+    # Уведомления уступают очередь отправки ответам пользователям
+    with notification_priority():
+        results = await asyncio.gather(*(notify_revoked(bot, _id) for _id in tg_ids))
+    sent = sum(results)
+    return sent, len(tg_ids) - sent
+
+
+async def notify_revoked(bot, tg_id: int) -> bool:
+    text = ("❌ Ваш доступ был отозван. Вы больше не можете пользоваться ботом\n\n"
+            "Для разблокировки нажмите команду /start и попробуйте заново авторизоваться "
+            "или обратитесь к администратору")
+    try:
+        # Лимиты частоты и повтор по retry_after обеспечивает OutboundScheduler
+        await bot.send_message(tg_id, text)
+        return True
+    except Exception as e:
+        # Пользователь заблокировал бота, удалил чат и т.п. - не мешает остальным
+        logger.error(f"Не удалось уведомить {tg_id} об отзыве доступа: {e}")
+        return False
+
+
+# Применяет отзыв доступа, сделанный любым процессом бота (уведомление Postgres из канала авторизации)
+async def apply_auth_change(storage, bot_id: int, event: dict):
+    if event["table"] == "sessions" and event["op"] == "DELETE":
+        await ban_user(storage, bot_id, event["row"]["tg_id"])
+        logger.info(f"Доступ пользователя {event['row']['tg_id']} отозван")
+
+
 # 6. Основной workflow:
-@router.message(AdminStates.admin)
+@router.message(AdminStates.admin, F.text)
 async def handle_admin_question(message: Message, auth_bot: Database):
-    await ask_llm(message, auth_bot)
+    question = await coalescer.collect(message.from_user.id, message.text)
+    if question is not None:  # None - сообщение вошло в вопрос, который отправит следующий обработчик
+        await ask_llm(message, auth_bot, question, admin=True)
 
 
-@router.message(UserStates.auth_confirmed)
+@router.message(UserStates.auth_confirmed, F.text)
 async def handle_user_question(message: Message, auth_bot: Database):
-    await ask_llm(message, auth_bot)
+    question = await coalescer.collect(message.from_user.id, message.text)
+    if question is not None:
+        await ask_llm(message, auth_bot, question)
+
+
+# Стикеры, фото, голосовые и т.п. - ИИ-ассистент понимает только текст
+@router.message(AdminStates.admin)
+@router.message(UserStates.auth_confirmed)
+async def handle_not_text_question(message: Message):
+    await message.answer("Извините, я понимаю только текстовые вопросы. Напишите, пожалуйста, вопрос текстом")
 
 
 @router.message(UserStates.banned)  # Или проверка состояния через БД
@@ -364,7 +556,33 @@ async def process_start(message: Message):
 
 
 # 8. Взаимодействие с LLM:
-async def ask_llm(message: Message, auth_bot: Database):
+def parse_llm_answer(response: str) -> tuple[int, str]:
+    """Отделяет код ответа (200 - рабочий вопрос, 100 - нет) и убирает техническую информацию"""
+    response = response.split('**********', 1)[0].strip()
+    if response.startswith("Код ответа — 200"):
+        return 200, response.replace("Код ответа — 200", "").strip()
+    return 100, response.replace("Код ответа — 100", "").strip()
+
+
+def degraded_response(question: str) -> str:
+    """Ответ, пока ValueAI недоступен: из кэша ответов, похожий вопрос из FAQ с пониженным порогом
+    или извинение"""
+    # Ответ мог попасть в кэш, пока вопрос ждал очереди; в кэше есть и ответы, которых нет в FAQ (код 100)
+    cached = valueai_client.cache.get(question)
+    if cached is not None:
+        return f"⚠️ ИИ-ассистент сейчас недоступен, вот ранее полученный ответ:\n\n{parse_llm_answer(cached)[1]}"
+    faq_match = faq_index.search(question, threshold=FAQ_DEGRADED_THRESHOLD)
+    if faq_match is not None:
+        return f"⚠️ ИИ-ассистент сейчас недоступен, вот ответ на похожий вопрос:\n\n{faq_match[0]}"
+    retry_in = max(round(valueai_client.breaker.retry_in / 60), 1)
+    return ("⚠️ ИИ-ассистент временно недоступен, мы уже разбираемся. "
+            f"Пожалуйста, повторите вопрос через {retry_in} мин.")
+
+
+async def ask_llm(message: Message, auth_bot: Database, question: str | None = None, admin: bool = False):
+    # Вопрос может состоять из нескольких сообщений, присланных подряд
+    question = question or message.text
+
     # Инициализация таймеров
     timers = {
         'total_start': datetime.now(),
@@ -377,27 +595,62 @@ async def ask_llm(message: Message, auth_bot: Database):
         'statistics': None
     }
 
+    # Ответ на похожий вопрос из FAQ-индекса не требует обращения к ИИ-ассистенту
+    faq_match = faq_index.search(question)
+    # Точный повтор вопроса отдаётся из кэша ответов сразу, без очереди к LLM
+    cached = valueai_client.cache.get(question) if faq_match is None else None
+    job = None
+    # Пока ValueAI недоступен, вопрос не ставится в очередь - ответ формируется сразу
+    if faq_match is None and cached is None and valueai_client.breaker.available():
+        try:
+            # Вопрос ждёт своей очереди к LLM (пользователи обслуживаются по кругу, админы - первыми)
+            job = llm_scheduler.submit(message.from_user.id, partial(valueai_client.request_llm, question),
+                                       admin=admin)
+        except LLMQueueFull as e:
+            logger.warning(f"Очередь к LLM переполнена: {e}")
+            await message.answer("Сейчас очень много вопросов, я не успеваю отвечать. "
+                                 "Пожалуйста, повторите вопрос через пару минут")
+            return
+        coalescer.attach(message.from_user.id, job.future)
+
     # 1. Отправляем сообщение "Обработка запроса..."
-    thinking_msg = await message.answer("Обработка запроса...")
+    position = llm_scheduler.position(job) if job is not None else 0
+    thinking_msg = await message.answer(
+        f"Обработка запроса... (ваш вопрос в очереди: {position})" if position else "Обработка запроса..."
+    )
     timers['thinking_msg'] = datetime.now()
 
     kod = 0
+    source = "llm"  # откуда взят ответ (пишется в статистику)
+    llm_time = None  # сколько ValueAI готовил ответ (только для ответов LLM)
     try:
-        # 2. Отправляем запрос к ИИ-ассистенту
+        # 2. Берём ответ из FAQ-индекса или дожидаемся ответа ИИ-ассистента
         timers['llm_request_start'] = datetime.now()
-        response = await valueai_client.send_message_to_llm(message.text)
+        if faq_match is not None:
+            # В индексе лежат уже очищенные ответы на рабочие вопросы (код 200)
+            response = f"Код ответа — 200\n\n{faq_match[0]}"
+            source = "faq"
+        elif cached is not None:
+            logger.info("Ответ взят из кэша")
+            response = cached
+            source = "cache"
+        elif job is None:
+            raise ServiceDegraded("ValueAI недоступен")
+        else:
+            try:
+                response, llm_time = await job
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                # Пользователь прислал новое сообщение - этот ответ уже никто не прочитает
+                logger.info(f"Запрос пользователя {message.from_user.id} заменён новым сообщением")
+                await thinking_msg.delete()
+                return
         timers['llm_request_end'] = datetime.now()
 
         # 3. Очищаем ответ от технической информации
         timers['response_processing_start'] = datetime.now()
-        response = response.split('**********', 1)[0].strip()
-
-        if response.startswith("Код ответа — 200"):
-            kod = 200
-            response = response.replace("Код ответа — 200", "").strip()
-        else:
-            kod = 100
-            response = response.replace("Код ответа — 100", "").strip()
+        kod, response = parse_llm_answer(response)
         timers['response_processing_end'] = datetime.now()
 
         print(f'код ответа = {kod}')
@@ -410,6 +663,10 @@ async def ask_llm(message: Message, auth_bot: Database):
                 "Попробуйте переформулировать вопрос или обратитесь позже"
             )
 
+    except ServiceDegraded as e:
+        logger.warning(f"Ответ без обращения к LLM: {e}")
+        response = degraded_response(question)
+
     except Exception as e:
         # 5. Логируем ошибку
         logger.error(f"Ошибка обработки сообщения: {e}")
@@ -442,22 +699,24 @@ async def ask_llm(message: Message, auth_bot: Database):
     # 10. Рассчитываем время выполнения
     timers['total_end'] = datetime.now()
 
-    # Вычисляем временные интервалы
-    total_time = round((timers['total_end'] - timers['total_start']).total_seconds(), 2)
-    llm_request_time = round((timers['llm_request_end'] - timers['llm_request_start']).total_seconds(), 2)
-    response_processing_time = round(
-        (timers['response_processing_end'] - timers['response_processing_start']).total_seconds(), 2)
-    cleanup_time = round((timers['cleanup_end'] - timers['cleanup_start']).total_seconds(), 2)
-    final_response_time = round((timers['final_response_end'] - timers['final_response_start']).total_seconds(), 2)
-    sending_response_time = round((timers['sending_response_end'] - timers['sending_response_start']).total_seconds(),
-                                  2)
+    # Вычисляем временные интервалы (после ошибки запроса к LLM части отметок нет - этап считаем за 0)
+    def span(stage: str) -> float:
+        start, end = timers.get(f'{stage}_start'), timers.get(f'{stage}_end')
+        return round((end - start).total_seconds(), 2) if start and end else 0.0
+
+    total_time = span('total')
+    llm_request_time = span('llm_request')
+    response_processing_time = span('response_processing')
+    cleanup_time = span('cleanup')
+    final_response_time = span('final_response')
+    sending_response_time = span('sending_response')
 
     # Логируем временные метки
     logger.debug(
         "\n=== Профилирование времени выполнения (ask llm) ==="
         f"1. Отправка thinking сообщения:"
         f" {round((timers['thinking_msg'] - timers['total_start']).total_seconds(), 2)} сек."
-        f"2. Запрос к LLM: {llm_request_time} сек. ({llm_request_time / total_time * 100:.1f}%)"
+        f"2. Запрос к LLM: {llm_request_time} сек. ({llm_request_time / max(total_time, 0.01) * 100:.1f}%)"
         f"3. Обработка ответа: {response_processing_time} сек."
         f"4. Удаление thinking сообщения: {cleanup_time} сек."
         f"5. Формирование финального ответа: {final_response_time} сек."
@@ -468,7 +727,7 @@ async def ask_llm(message: Message, auth_bot: Database):
     # Запись статистики
     timers['statistics_start'] = datetime.now()
     if kod == 200:
-        await auth_bot.save_statistics(message.text, response, processing_time)
+        await auth_bot.save_statistics(question, response, processing_time, source, llm_time)
 
     timers['statistics_end'] = datetime.now()
 
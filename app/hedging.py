@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки дублирования (hedging) медленных запросов к ValueAI (можно переопределить через .env)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"  # по умолчанию выключено
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))  # дублируем, если этап идёт дольше этого перцентиля
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))  # не больше такой доли дополнительных запросов
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "3"))  # сколько дублей можно накопить про запас
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # меньше наблюдений - перцентилю не верим
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))  # раньше этого не дублируем, сек.
+HEDGE_HISTORY = int(os.getenv("HEDGE_HISTORY", "500"))  # сколько последних времён этапа помнить
+
+
+class LatencyTracker:
+    """Последние времена выполнения этапа и их перцентили"""
+
+    def __init__(self, history: int = HEDGE_HISTORY):
+        self._samples: deque[float] = deque(maxlen=history)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def seed(self, samples):
+        self._samples.extend(float(s) for s in samples if s and s > 0)
+
+    def quantile(self, q: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class HedgeBudget:
+    """Каждый запрос добавляет ratio «права на дубль», дубль тратит целое право:
+    дополнительных запросов не больше ratio от общего числа"""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET, burst: float = HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.credits = 0.0
+
+    def deposit(self):
+        self.credits = min(self.credits + self.ratio, self.burst)
+
+    def withdraw(self) -> bool:
+        if self.credits < 1:
+            return False
+        self.credits -= 1
+        return True
+
+
+class Hedger:
+    """Если этап не завершился за свой p95, запускает дубль и берёт первый успешный результат.
+    Проигравшая попытка отменяется, либо (если передан discard) дорабатывает и отдаётся в discard -
+    так созданный ею чат не остаётся на сервере"""
+
+    def __init__(self,
+                 enabled: bool = HEDGE_ENABLED,
+                 quantile: float = HEDGE_QUANTILE,
+                 budget: HedgeBudget | None = None,
+                 min_samples: int = HEDGE_MIN_SAMPLES,
+                 min_delay: float = HEDGE_MIN_DELAY):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.budget = budget if budget is not None else HedgeBudget()
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._stages: dict[str, LatencyTracker] = {}
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def tracker(self, stage: str) -> LatencyTracker:
+        tracker = self._stages.get(stage)
+        if tracker is None:
+            tracker = self._stages[stage] = LatencyTracker()
+        return tracker
+
+    async def load(self, db, stage: str):
+        """Начальные времена этапа из statistics_table.llm_time: только ответы LLM и той же мерой,
+        что этап ответа (от создания чата до готовности ответа)"""
+        if not self.enabled:
+            return
+        tracker = self.tracker(stage)
+        tracker.seed(await db.fetch_answer_times(HEDGE_HISTORY))
+        logger.info(f"Hedging: для этапа {stage} загружено {len(tracker)} времён ответа")
+
+    def delay(self, stage: str) -> float | None:
+        """Через сколько секунд дублировать этап (None - не дублировать)"""
+        tracker = self.tracker(stage)
+        if not self.enabled or len(tracker) < self.min_samples:
+            return None
+        return max(tracker.quantile(self.quantile), self.min_delay)
+
+    async def _timed(self, tracker: LatencyTracker, attempt):
+        start = time.monotonic()
+        result = await attempt()
+        tracker.record(time.monotonic() - start)
+        return result
+
+    async def run(self, stage: str, attempt, hedge=None, discard=None):
+        """Выполняет await attempt(); дубль - await hedge() (по умолчанию ещё раз attempt())"""
+        tracker = self.tracker(stage)
+        delay = self.delay(stage)
+        self.budget.deposit()
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(self._timed(tracker, attempt))]
+        winner = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.budget.withdraw():
+                    self.hedged += 1
+                    logger.info(f"Hedging: этап {stage} идёт дольше {delay:.2f} сек., запускаем дубль")
+                    tasks.append(asyncio.ensure_future(self._timed(tracker, hedge or attempt)))
+
+            pending = set(tasks)
+            while pending:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Победитель - первая успешная попытка; ошибка одной попытки не мешает дождаться другой
+                winner = next((t for t in tasks if t.done() and t.exception() is None), None)
+                if winner is not None:
+                    if winner is not tasks[0]:
+                        self.hedge_wins += 1
+                        if discard is None:
+                            # Основная попытка будет отменена и сама своё время не запишет; без него
+                            # в истории остаются только быстрые дубли и порог сползает вниз. Её время
+                            # не меньше прошедшего - его и учитываем
+                            tracker.record(time.monotonic() - start)
+                    return winner.result()
+            # Обе попытки неудачны - наружу уходит ошибка основной
+            return tasks[0].result()
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    self._drop(task, discard)
+
+    @staticmethod
+    def _drop(task: asyncio.Future, discard):
+        if discard is None:
+            task.cancel()
+            return
+
+        def release(done: asyncio.Future):
+            if not done.cancelled() and done.exception() is None:
+                discard(done.result())
+
+        task.add_done_callback(release)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "delays": {stage: self.delay(stage) for stage in self._stages},
+        }
@@ -0,0 +1,72 @@
+import logging
+import os
+
+# Библиотека для асинхронных HTTP-запросов
+# Здесь используется для одной долгоживущей сессии с пулом соединений
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки пула соединений к ValueAI (можно переопределить через .env)
+HTTP_POOL_LIMIT = int(os.getenv("VALUEAI_HTTP_POOL_LIMIT", "100"))  # всего одновременных соединений
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("VALUEAI_HTTP_POOL_LIMIT_PER_HOST", "30"))  # соединений на один хост
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("VALUEAI_HTTP_KEEPALIVE_TIMEOUT", "60"))  # сколько держать простаивающее соединение
+HTTP_DNS_CACHE_TTL = int(os.getenv("VALUEAI_HTTP_DNS_CACHE_TTL", "300"))  # время жизни DNS-кэша, сек.
+HTTP_TOTAL_TIMEOUT = float(os.getenv("VALUEAI_HTTP_TOTAL_TIMEOUT", "60"))  # общий таймаут одного запроса
+HTTP_CONNECT_TIMEOUT = float(os.getenv("VALUEAI_HTTP_CONNECT_TIMEOUT", "10"))  # таймаут установки соединения
+
+
+class HTTPSessionManager:
+    """Общая HTTP-сессия с пулом соединений для всех запросов к ValueAI"""
+
+    def __init__(self,
+                 limit: int = HTTP_POOL_LIMIT,
+                 limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+                 dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+                 total_timeout: float = HTTP_TOTAL_TIMEOUT,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session: aiohttp.ClientSession | None = None
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        # Коннектор держит TCP+TLS соединения открытыми между запросами
+        # и кэширует DNS, поэтому каждый вопрос не платит за новые рукопожатия
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def start(self) -> aiohttp.ClientSession:
+        """Создаёт сессию (если ещё не создана). Вызывается из main.main()"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+            logger.info(f"HTTP-сессия ValueAI создана (limit={self.limit}, limit_per_host={self.limit_per_host})")
+        return self._session
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Текущая сессия; создаётся лениво, если start() ещё не вызывался"""
+        if self._session is None or self._session.closed:
+            # Свойство читается только из корутин, поэтому event loop уже запущен
+            self._session = self._create_session()
+        return self._session
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-сессия ValueAI закрыта")
+        self._session = None
@@ -1,4 +1,170 @@
+import asyncio
+import logging
+import os
+
 import asyncpg
+from dotenv import load_dotenv
+
+from app.auth_cache import AuthCache, MISSING
+from app.auth_events import AuthChangeListener
+from app.migrate import migrate
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки буферизованной записи статистики
+STATS_QUEUE_SIZE = int(os.getenv("STATS_QUEUE_SIZE", "10000"))  # максимум записей в очереди
+STATS_BATCH_SIZE = int(os.getenv("STATS_BATCH_SIZE", "200"))  # записей в одном COPY
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "1"))  # максимальная задержка записи, сек.
+STATS_ENQUEUE_TIMEOUT = float(os.getenv("STATS_ENQUEUE_TIMEOUT", "0.05"))  # ожидание места в полной очереди, сек.
+STATS_DRAIN_TIMEOUT = float(os.getenv("STATS_DRAIN_TIMEOUT", "10"))  # ожидание записи остатка при остановке
+STATS_WRITE_ATTEMPTS = int(os.getenv("STATS_WRITE_ATTEMPTS", "2"))  # попыток записать пачку
+STATS_RETRY_DELAY = float(os.getenv("STATS_RETRY_DELAY", "1"))  # пауза перед повтором записи пачки, сек.
+STATS_COPY_THRESHOLD = 20  # с какого размера пачки выгоднее COPY, чем подготовленный INSERT
+
+# Настройки пула соединений Postgres
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))  # сек.
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "10"))  # сек.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Применять миграции схемы (app/migrations) при подключении
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+# Горячие запросы: текст общий для всех вызовов, поэтому asyncpg готовит каждый из них один раз
+# на соединение и дальше берёт из кэша statement'ов соединения
+HOT_QUERIES = {
+    'login_exists': "SELECT 1 FROM login_table WHERE login = $1",
+    'is_user_admin': """
+        SELECT lt.is_admin
+        FROM login_table lt
+        JOIN sessions s ON lt.login = s.login
+        WHERE lt.login = $1 AND s.tg_id = $2
+    """,
+    'add_session': """
+        INSERT INTO sessions (tg_id, login)
+        VALUES ($1, $2)
+        ON CONFLICT (tg_id) DO NOTHING
+    """,
+    'save_statistics': """
+        INSERT INTO statistics_table (question, answer, answer_time, source, llm_time)
+        VALUES ($1, $2, $3, $4, $5)
+    """,
+}
+# Читающие горячие запросы и параметры, которые ничего не находят: ими прогревается каждое
+# новое соединение пула, чтобы первый вход пользователя не ждал подготовки запроса
+HOT_QUERIES_WARM_UP = {
+    'login_exists': ('',),
+    'is_user_admin': ('', 0),
+}
+
+
+class StatisticsWriter:
+    """Фоновая запись статистики пачками: обработчик не ждёт INSERT в Postgres"""
+
+    _columns = ('question', 'answer', 'answer_time', 'source', 'llm_time')
+
+    def __init__(self, db: "Database",
+                 queue_size: int = STATS_QUEUE_SIZE,
+                 batch_size: int = STATS_BATCH_SIZE,
+                 flush_interval: float = STATS_FLUSH_INTERVAL,
+                 enqueue_timeout: float = STATS_ENQUEUE_TIMEOUT):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker: asyncio.Task | None = None
+        self.written = 0
+        self.dropped = 0
+
+    async def put(self, record: tuple):
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            # Postgres не успевает - немного ждём места, затем отбрасываем запись
+            try:
+                await asyncio.wait_for(self._queue.put(record), timeout=self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.dropped += 1
+                logger.warning(f"Очередь статистики переполнена, записей отброшено: {self.dropped}")
+
+    async def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Записывает всё, что осталось в очереди, и останавливает воркер"""
+        if self._worker is None:
+            return
+
+        async def drain():
+            # None - сигнал воркеру записать последнюю пачку и завершиться; при полной очереди
+            # ожидание места для него тоже идёт в счёт STATS_DRAIN_TIMEOUT
+            await self._queue.put(None)
+            await self._worker
+
+        try:
+            await asyncio.wait_for(drain(), timeout=STATS_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Не удалось дописать статистику при остановке, в очереди: {self._queue.qsize()}")
+            self._worker.cancel()
+        self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            record = await self._queue.get()
+            if record is None:
+                break
+            batch = [record]
+            # Добираем пачку до batch_size или до истечения flush_interval
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            await self._write(batch)
+
+    async def _write(self, batch: list[tuple]):
+        for attempt in range(1, STATS_WRITE_ATTEMPTS + 1):
+            try:
+                async with self.db.pool.acquire() as connection:
+                    if len(batch) >= STATS_COPY_THRESHOLD:
+                        await connection.copy_records_to_table(
+                            'statistics_table', records=batch, columns=self._columns
+                        )
+                    else:
+                        await connection.executemany(HOT_QUERIES['save_statistics'], batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                if attempt < STATS_WRITE_ATTEMPTS:
+                    # Обрыв соединения, рестарт Postgres и т.п. - повторяем пачку целиком
+                    # (COPY и executemany атомарны, частичной записи не бывает)
+                    logger.warning(f"Ошибка записи статистики ({len(batch)} записей): {e}, повторим")
+                    await asyncio.sleep(STATS_RETRY_DELAY * 2 ** (attempt - 1))
+                    continue
+                self.dropped += len(batch)
+                logger.error(f"Ошибка записи статистики ({len(batch)} записей), пачка отброшена: {e}")
 
 
 class Database:
@@ -9,30 +175,121 @@ class Database:
         self.host = host
         self.port = port
         self.pool = None
+        # Подписчики на новые записи статистики (например, FAQ-индекс)
+        self._statistics_listeners = []
+        # Статистика пишется в фоне пачками
+        self.statistics_writer = StatisticsWriter(self)
+        # Кэш проверок авторизации; сбрасывается методами, меняющими логины и сессии
+        self.auth_cache = AuthCache()
+        # Изменения логинов и сессий, сделанные любым процессом бота (LISTEN/NOTIFY)
+        self.auth_events = AuthChangeListener(self)
+        self.auth_events.add_listener(self._apply_auth_change)
+
+    def add_statistics_listener(self, listener):
+        """Регистрирует функцию listener(question, answer), вызываемую после записи статистики"""
+        self._statistics_listeners.append(listener)
+
+    def add_auth_listener(self, listener):
+        """Регистрирует async-функцию listener(event), вызываемую при изменении login_table/sessions"""
+        self.auth_events.add_listener(listener)
+
+    async def _apply_auth_change(self, event: dict):
+        # Изменение могло прийти из другого процесса - сбрасываем локальный кэш авторизации
+        row = event.get("row") or {}
+        if event["op"] == "RESYNC":
+            self.auth_cache.clear()
+        if row.get("login") is not None:
+            self.auth_cache.invalidate_login(row["login"])
+        if row.get("tg_id") is not None:
+            self.auth_cache.invalidate_tg_id(row["tg_id"])
 
     async def close(self):
+        await self.auth_events.close()
+        # Сначала дописываем накопленную статистику, потом закрываем пул
+        await self.statistics_writer.close()
         if self.pool:
             await self.pool.close()
 
     async def connect(self):
+        if DB_AUTO_MIGRATE:
+            await self.migrate()
         self.pool = await asyncpg.create_pool(
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            host=self.host,
+            port=self.port,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            init=self._init_connection
+        )
+        await self.statistics_writer.start()
+        await self.auth_events.start()
+
+    # миграции выполняются на отдельном соединении до создания пула: подготовленные запросы
+    # соединений пула сразу видят итоговую схему (например, sessions.tg_id типа bigint)
+    async def migrate(self):
+        connection = await asyncpg.connect(
             user=self.user,
             password=self.password,
             database=self.database,
             host=self.host,
             port=self.port
         )
+        try:
+            await migrate(connection)
+        finally:
+            await connection.close()
+
+    # create_pool сразу открывает min_size соединений и вызывает init для каждого (и для новых
+    # соединений позже): запросы выполняются вне транзакции и попадают в кэш statement'ов соединения
+    @staticmethod
+    async def _init_connection(connection):
+        for name, args in HOT_QUERIES_WARM_UP.items():
+            await connection.fetch(HOT_QUERIES[name], *args)
 
     # поменять дельтатйм на флоат
-    async def save_statistics(self, question: str, answer: str, answer_time: float):
+    # запись ставится в очередь и пишется в Postgres фоновым StatisticsWriter;
+    # source - откуда взят ответ: llm, cache или faq; llm_time - сколько ValueAI готовил ответ
+    async def save_statistics(self, question: str, answer: str, answer_time: float, source: str = "llm",
+                              llm_time: float | None = None):
+        await self.statistics_writer.put((question, answer, answer_time, source, llm_time))
+        # Подписчики (FAQ-индекс) получают только новые ответы LLM: повторно выданный ответ
+        # на перефразированный вопрос не должен становиться ответом на ещё один вопрос
+        if source == "llm":
+            for listener in self._statistics_listeners:
+                listener(question, answer)
+
+    # последние времена подготовки ответа ValueAI (та же мера, что и AnswerPollScheduler.record) -
+    # для расписания опроса; ответы из кэша и FAQ и старые записи без llm_time не учитываются
+    async def fetch_answer_times(self, limit: int):
         async with self.pool.acquire() as connection:
-            await connection.execute(
+            rows = await connection.fetch(
+                "SELECT llm_time FROM statistics_table WHERE llm_time IS NOT NULL ORDER BY id DESC LIMIT $1",
+                limit
+            )
+            return [row['llm_time'] for row in rows]
+
+    # последние отвеченные вопросы (в хронологическом порядке) для FAQ-индекса
+    async def fetch_answered_questions(self, limit: int):
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(
                 """
-                INSERT INTO statistics_table (question, answer, answer_time)
-                VALUES ($1, $2, $3)
+                SELECT question, answer FROM (
+                    SELECT id, question, answer
+                    FROM statistics_table
+                    WHERE answer IS NOT NULL AND answer <> '' AND coalesce(source, 'llm') = 'llm'
+                    ORDER BY id DESC
+                    LIMIT $1
+                ) recent
+                ORDER BY id
                 """,
-                question, answer, answer_time
+                limit
             )
+            return [(row['question'], row['answer']) for row in rows]
 
     # добавление и удаление логина пользователя
     async def add_login(self, login: str):
@@ -45,6 +302,7 @@ class Database:
                 """,
                 login, False
             )
+        self.auth_cache.invalidate_login(login)
 
     async def remove_login(self, login: str):
         async with self.pool.acquire() as connection:
@@ -55,14 +313,43 @@ class Database:
                 """,
                 login
             )
+        self.auth_cache.invalidate_login(login)
+
+    # массовое добавление логинов: один COPY во временную таблицу и один INSERT ... ON CONFLICT
+    async def import_logins(self, logins) -> tuple[int, int]:
+        """Возвращает (добавлено, уже существовали); logins - итерируемое, читается потоково"""
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(
+                    "CREATE TEMP TABLE import_logins (login text NOT NULL) ON COMMIT DROP"
+                )
+                await connection.copy_records_to_table(
+                    'import_logins', records=((login,) for login in logins), columns=('login',)
+                )
+                total = await connection.fetchval("SELECT count(DISTINCT login) FROM import_logins")
+                added = await connection.fetch(
+                    """
+                    INSERT INTO login_table (login, is_admin)
+                    SELECT DISTINCT login, false FROM import_logins
+                    ON CONFLICT (login) DO NOTHING
+                    RETURNING login
+                    """
+                )
+        # Новые логины могли быть закэшированы как несуществующие
+        for row in added:
+            self.auth_cache.invalidate_login(row['login'])
+        return len(added), total - len(added)
 
     async def login_exists(self, login: str) -> bool:
+        cached = self.auth_cache.get_login(login)
+        if cached is not MISSING:
+            return cached
+        generation = self.auth_cache.generation
         async with self.pool.acquire() as connection:
-            result = await connection.fetchval(
-                "SELECT 1 FROM login_table WHERE login = $1",
-                login
-            )
-            return result is not None
+            result = await connection.fetchval(HOT_QUERIES['login_exists'], login)
+        exists = result is not None
+        self.auth_cache.set_login(login, exists, generation)
+        return exists
 
     async def delete_login_with_tg_ids(self, login: str):
         async with self.pool.acquire() as connection:
@@ -76,8 +363,8 @@ class Database:
                 await connection.execute(
                     "DELETE FROM login_table WHERE login = $1", login
                 )
-
-                return [record['tg_id'] for record in tg_ids]
+        self.auth_cache.invalidate_login(login)
+        return [record['tg_id'] for record in tg_ids]
 
     # проверка на существование и что админ
     async def set_admin_status(self, login: str, admin: bool):
@@ -90,33 +377,25 @@ class Database:
                 """,
                 admin, login
             )
+        self.auth_cache.invalidate_login(login)
 
     async def is_user_admin(self, login: str, tg_id: int) -> bool | None:
+        cached = self.auth_cache.get_admin(login, tg_id)
+        if cached is not MISSING:
+            return cached
+        generation = self.auth_cache.generation
         async with self.pool.acquire() as connection:
-            result = await connection.fetchrow(
-                """
-                SELECT lt.is_admin
-                FROM login_table lt
-                JOIN sessions s ON lt.login = s.login
-                WHERE lt.login = $1 AND s.tg_id = $2
-                """,
-                login, tg_id
-            )
-            if result:
-                return result['is_admin']
-            return None  # Логин или tg_id не найдены или не связаны
+            result = await connection.fetchrow(HOT_QUERIES['is_user_admin'], login, tg_id)
+        # None - логин или tg_id не найдены или не связаны
+        is_admin = result['is_admin'] if result else None
+        self.auth_cache.set_admin(login, tg_id, is_admin, generation)
+        return is_admin
 
     # Функция добавления записи в sessions
     async def add_session(self, tg_id: int, login: str):
         async with self.pool.acquire() as connection:
-            await connection.execute(
-                """
-                INSERT INTO sessions (tg_id, login)
-                VALUES ($1, $2)
-                ON CONFLICT (tg_id) DO NOTHING
-                """,
-                tg_id, login
-            )
+            await connection.execute(HOT_QUERIES['add_session'], tg_id, login)
+        self.auth_cache.invalidate_tg_id(tg_id)
 
     # Функция удаления записи по tg_id
     async def remove_session(self, tg_id: int):
@@ -128,3 +407,4 @@ class Database:
                 """,
                 tg_id
             )
+        self.auth_cache.invalidate_tg_id(tg_id)
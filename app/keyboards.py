@@ -56,6 +56,7 @@ kb_comands = InlineKeyboardMarkup(
 def get_admin_kb():
     buttons = [
         [InlineKeyboardButton(text="Добавить пользователя", callback_data="admin_add_user")],
+        [InlineKeyboardButton(text="Загрузить список пользователей", callback_data="admin_import_users")],
         [InlineKeyboardButton(text="Удалить пользователя", callback_data="admin_remove_user")],
         [InlineKeyboardButton(text='Закрыть', callback_data='close_admin_kb')]
     ]
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки очереди запросов к LLM (можно переопределить через .env)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))  # одновременных запросов к ValueAI
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "50"))  # сверх этого новые вопросы отклоняются
+
+
+class LLMQueueFull(Exception):
+    """Очередь запросов к LLM переполнена"""
+    pass
+
+
+class LLMJob:
+    """Вопрос в очереди: future получает ответ (или исключение) от func()"""
+    __slots__ = ("user_id", "admin", "func", "future")
+
+    def __init__(self, user_id: int, admin: bool, func):
+        self.user_id = user_id
+        self.admin = admin
+        self.func = func
+        self.future = asyncio.get_running_loop().create_future()
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class LLMScheduler:
+    """Пул из max_in_flight воркеров с очередью: пользователи обслуживаются по кругу
+    (по одному вопросу за проход), вопросы админов - раньше вопросов пользователей"""
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, max_queue: int = LLM_MAX_QUEUE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        # admin -> {user_id: очередь вопросов пользователя}; порядок ключей = порядок обхода по кругу
+        self._rings: dict[bool, OrderedDict[int, deque[LLMJob]]] = {True: OrderedDict(), False: OrderedDict()}
+        self._queued = 0
+        # Сколько вопросов ждут воркера (воркер забирает по одному)
+        self._jobs = asyncio.Semaphore(0)
+        self._workers: list[asyncio.Task] = []
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, user_id: int, func, admin: bool = False) -> LLMJob:
+        """Ставит вызов func() в очередь; ответ получается через await job"""
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFull(f"в очереди {self._queued} вопросов")
+        job = LLMJob(user_id, admin, func)
+        ring = self._rings[admin]
+        ring.setdefault(user_id, deque()).append(job)
+        self._queued += 1
+        # Обработчик отменён, пока вопрос ждал в очереди, - освобождаем место сразу
+        job.future.add_done_callback(lambda future: self._discard(job) if future.cancelled() else None)
+        self._jobs.release()
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_in_flight)]
+        return job
+
+    def position(self, job: LLMJob) -> int:
+        """Примерное место вопроса в очереди (1 - следующий), 0 - уже обрабатывается"""
+        ring = self._rings[job.admin]
+        own = ring.get(job.user_id)
+        if not own or job not in own:
+            return 0
+        depth = own.index(job)
+        # За каждый проход по кругу каждый пользователь получает по одному вопросу;
+        # стоящие в круге раньше успевают получить ответ и в проходе, где обслуживается наш вопрос
+        ahead, before = depth, True
+        for user_id, jobs in ring.items():
+            if user_id == job.user_id:
+                before = False
+            else:
+                ahead += min(len(jobs), depth + 1 if before else depth)
+        if not job.admin:
+            ahead += sum(len(jobs) for jobs in self._rings[True].values())
+        # Свободный воркер заберёт вопрос сразу
+        return max(ahead + 1 - (self.max_in_flight - self.in_flight), 0)
+
+    def _discard(self, job: LLMJob):
+        ring = self._rings[job.admin]
+        jobs = ring.get(job.user_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del ring[job.user_id]
+            self._queued -= 1
+
+    def _next(self) -> LLMJob | None:
+        for admin in (True, False):
+            ring = self._rings[admin]
+            if ring:
+                user_id, jobs = ring.popitem(last=False)
+                job = jobs.popleft()
+                if jobs:
+                    ring[user_id] = jobs  # у пользователя есть ещё вопросы - в конец круга
+                self._queued -= 1
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            await self._jobs.acquire()
+            job = self._next()
+            if job is None or job.future.done():
+                continue  # ожидавший ответа обработчик уже отменён
+            self.in_flight += 1
+            task = asyncio.ensure_future(job.func())
+            # Если ответ больше не нужен, прекращаем и сам запрос к LLM
+            job.future.add_done_callback(lambda future, task=task: task.cancel() if future.cancelled() else None)
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # останавливается сам воркер
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for ring in self._rings.values():
+            for jobs in ring.values():
+                for job in jobs:
+                    job.future.cancel()
+            ring.clear()
+        self._queued = 0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self._queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import re
+from pathlib import Path
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Каталог с миграциями: файлы вида 001_описание.sql применяются по возрастанию номера
+MIGRATIONS_DIR = Path(__file__).with_name("migrations")
+# Ключ advisory-блокировки: одновременно стартующие процессы бота применяют миграции по очереди
+MIGRATIONS_LOCK_KEY = 4815162342
+
+_migration_name = re.compile(r"^(\d+)_[\w-]+\.sql$")
+
+
+def load_migrations(directory: Path = MIGRATIONS_DIR) -> list[tuple[int, str, str]]:
+    """Возвращает [(номер, имя файла, SQL)] в порядке применения"""
+    migrations = []
+    for path in directory.iterdir():
+        match = _migration_name.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), path.name, path.read_text(encoding="utf-8")))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Повторяющиеся номера миграций в {directory}")
+    return migrations
+
+
+async def migrate(connection: asyncpg.Connection, directory: Path = MIGRATIONS_DIR) -> int:
+    """Применяет ещё не применённые миграции (каждую в своей транзакции), возвращает их количество"""
+    await connection.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_KEY)
+    try:
+        await connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name text NOT NULL,
+                applied_at timestamp with time zone DEFAULT now() NOT NULL
+            )
+            """
+        )
+        applied = {row['version'] for row in await connection.fetch("SELECT version FROM schema_migrations")}
+
+        count = 0
+        for version, name, sql in load_migrations(directory):
+            if version in applied:
+                continue
+            async with connection.transaction():
+                await connection.execute(sql)
+                await connection.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                    version, name
+                )
+            logger.info(f"Применена миграция {name}")
+            count += 1
+        return count
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
+
+
+# ручной запуск: python -m app.migrate (параметры подключения - из .env, как в main.py)
+async def main():
+    connection = await asyncpg.connect(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT")
+    )
+    try:
+        count = await migrate(connection)
+        logger.info(f"Схема БД актуальна, применено миграций: {count}")
+    finally:
+        await connection.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+-- Публикация изменений login_table/sessions в канал hr_auth_changes (см. app/auth_events.py).
+-- Каждая вставка/изменение/удаление строки уходит как JSON {"table": ..., "op": ..., "row": {...}}.
+-- Удаление логина каскадно удаляет его сессии, поэтому слушатели получают и tg_id отозванных пользователей
+CREATE OR REPLACE FUNCTION public.notify_auth_change() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    changed record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    PERFORM pg_notify(TG_ARGV[0], json_build_object(
+        'table', TG_TABLE_NAME, 'op', TG_OP, 'row', to_jsonb(changed)
+    )::text);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS notify_login_table_change ON public.login_table;
+CREATE TRIGGER notify_login_table_change AFTER INSERT OR UPDATE OR DELETE ON public.login_table
+    FOR EACH ROW EXECUTE FUNCTION public.notify_auth_change('hr_auth_changes');
+
+DROP TRIGGER IF EXISTS notify_sessions_change ON public.sessions;
+CREATE TRIGGER notify_sessions_change AFTER INSERT OR UPDATE OR DELETE ON public.sessions
+    FOR EACH ROW EXECUTE FUNCTION public.notify_auth_change('hr_auth_changes');
@@ -0,0 +1,2 @@
+-- Поиск сессий по логину: delete_login_with_tg_ids, JOIN в is_user_admin, триггер log_deleted_sessions
+CREATE INDEX IF NOT EXISTS sessions_login_idx ON public.sessions (login);
@@ -0,0 +1,2 @@
+-- Выборки статистики за период
+CREATE INDEX IF NOT EXISTS statistics_table_answer_date_idx ON public.statistics_table (answer_date);
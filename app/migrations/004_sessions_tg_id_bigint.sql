@@ -0,0 +1,2 @@
+-- Telegram ID не помещаются в integer (deleted_sessions_log.tg_id уже bigint)
+ALTER TABLE public.sessions ALTER COLUMN tg_id TYPE bigint;
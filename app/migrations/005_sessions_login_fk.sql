@@ -0,0 +1,18 @@
+-- Внешний ключ sessions.login -> login_table создан как NOT VALID под именем "ее":
+-- удаляем осиротевшие сессии, проверяем ограничение и даём ему нормальное имя
+DELETE FROM public.sessions s
+WHERE NOT EXISTS (SELECT 1 FROM public.login_table lt WHERE lt.login = s.login);
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ее' AND conrelid = 'public.sessions'::regclass) THEN
+        ALTER TABLE public.sessions RENAME CONSTRAINT "ее" TO sessions_login_fkey;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'sessions_login_fkey' AND conrelid = 'public.sessions'::regclass) THEN
+        ALTER TABLE public.sessions ADD CONSTRAINT sessions_login_fkey
+            FOREIGN KEY (login) REFERENCES public.login_table(login) ON DELETE CASCADE;
+    END IF;
+END;
+$$;
+
+ALTER TABLE public.sessions VALIDATE CONSTRAINT sessions_login_fkey;
@@ -0,0 +1,3 @@
+-- Откуда взят ответ: llm, cache (кэш ответов), faq (похожий вопрос из FAQ-индекса).
+-- У записей до этой миграции источник неизвестен (NULL) - считаем их ответами LLM
+ALTER TABLE public.statistics_table ADD COLUMN IF NOT EXISTS source varchar(8);
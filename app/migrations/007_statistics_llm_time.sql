@@ -0,0 +1,3 @@
+-- Сколько ValueAI готовил ответ (от создания чата до готовности), сек. - по этим временам
+-- строится расписание опроса. answer_time - полное время ответа пользователю (с очередью и Telegram)
+ALTER TABLE public.statistics_table ADD COLUMN IF NOT EXISTS llm_time real;
@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from dotenv import load_dotenv
+
+from app.rate_limit import (TokenBucket, TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST, TELEGRAM_CHAT_RATE,
+                            TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE)
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))  # повторов запроса после ответа 429
+OUTBOUND_MAX_CHATS = int(os.getenv("OUTBOUND_MAX_CHATS", "10000"))  # сколько лимитов по чатам держать в памяти
+
+# Приоритеты исходящих запросов: меньше - важнее
+PRIORITY_INTERACTIVE = 0  # ответы пользователю, который ждёт в чате
+PRIORITY_NOTIFICATION = 1  # массовые уведомления (отзыв доступа и т.п.)
+
+# Методы, которые отправляют в чат новое сообщение: только на них действует лимит Telegram на чат
+# (кроме send* - копирование и пересылка). Правки и удаления ограничены только общим лимитом бота
+CHAT_LIMITED_METHODS = {"copyMessage", "copyMessages", "forwardMessage", "forwardMessages"}
+
+# Приоритет запросов текущей задачи (задачи, созданные внутри, наследуют его)
+outbound_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def notification_priority():
+    """Запросы к Telegram внутри блока уступают очередь интерактивным ответам"""
+    token = outbound_priority.set(PRIORITY_NOTIFICATION)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Telegram (middleware сессии бота): лимиты на чат и на бота,
+    очередь с приоритетами, пауза и повтор по retry_after"""
+
+    def __init__(self,
+                 global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 global_burst: int = TELEGRAM_GLOBAL_BURST,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_retries = max_retries
+        self._chats: OrderedDict[int | str, TokenBucket] = OrderedDict()
+        # Очередь ожидающих глобального токена: (приоритет, порядковый номер, future)
+        self._heap: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._ready = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+        # До этого момента (loop.time()) Telegram просил ничего не отправлять
+        self._paused_until = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.max_depth = 0
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id - группа или канал, у них лимит строже
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(
+                TELEGRAM_GROUP_RATE if group else TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST
+            )
+            while len(self._chats) > OUTBOUND_MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_turn(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self.max_depth = max(self.max_depth, len(self._heap))
+        self._ready.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.wait()
+            if not self._heap:
+                self._ready.clear()
+                continue
+            pause = self._paused_until - loop.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            await self.global_bucket.acquire()
+            # Берём из очереди только после получения токена: пришедший за это время
+            # интерактивный ответ обгонит ожидающие уведомления
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, getMe, answerCallbackQuery и т.п. - без очереди
+            return await make_request(bot, method)
+
+        api_method = method.__api_method__
+        per_chat = api_method.startswith("send") or api_method in CHAT_LIMITED_METHODS
+        priority = outbound_priority.get()
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            if per_chat:
+                await self._chat_bucket(chat_id).acquire()
+            await self._wait_turn(priority)
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.retried += 1
+                if attempt == self.max_retries:
+                    raise
+                # Флуд-контроль: приостанавливаем всю отправку и повторяем запрос
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+                logger.warning(f"Telegram: flood control для чата {chat_id}, пауза {e.retry_after} сек.")
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+    def stats(self) -> dict:
+        waiting = [priority for priority, _, future in self._heap if not future.done()]
+        return {
+            "depth": len(waiting),
+            "interactive": waiting.count(PRIORITY_INTERACTIVE),
+            "notifications": waiting.count(PRIORITY_NOTIFICATION),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "retried": self.retried,
+        }
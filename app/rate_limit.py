@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Лимиты Telegram Bot API (держимся с небольшим запасом):
+# всего от бота - около 30 сообщений в секунду
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "28"))  # сообщений в секунду
+TELEGRAM_GLOBAL_BURST = int(os.getenv("TELEGRAM_GLOBAL_BURST", "28"))  # сколько можно отправить разом
+# в один личный чат - около 1 сообщения в секунду (короткие всплески допустимы)
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+# в одну группу - не больше 20 сообщений в минуту
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+
+# Сколько ведер (пользователей и ролей) держать в памяти RateLimiter
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+
+
+class TokenBucket:
+    """Ограничитель частоты «ведро токенов»: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Забирает токены, если они есть прямо сейчас (не ждёт)"""
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def acquire(self, tokens: float = 1):
+        """Ждёт, пока освободятся токены. Токены резервируются сразу, поэтому ожидающие
+        обслуживаются в порядке вызова, без общей блокировки"""
+        self._refill()
+        self.tokens -= tokens
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Множество независимых ведер токенов в одном словаре: ключ -> (токены, момент обновления).
+    Два float на пользователя вместо объекта TokenBucket на каждого"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: dict[str, tuple[float, float]] = {}
+
+    async def take(self, key: str, rate: float, capacity: int) -> float:
+        """Забирает токен; возвращает 0, если можно продолжать, иначе сколько секунд ждать"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return wait
+
+    def _prune(self, now: float):
+        # Удаляем ведра, которые давно не трогали (к этому времени они заведомо полные)
+        for key in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:len(self._buckets) - self.max_keys // 2]:
+            del self._buckets[key]
+
+
+class RedisRateLimiter:
+    """Те же ведра токенов в Redis - общие для нескольких процессов бота; проверка атомарна (Lua)"""
+
+    # Время берётся у Redis (TIME), чтобы часы разных воркеров не влияли на лимиты
+    SCRIPT = """
+        local now = redis.call('TIME')
+        now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+        local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+        local tokens = tonumber(redis.call('HGET', KEYS[1], 't') or capacity)
+        local updated = tonumber(redis.call('HGET', KEYS[1], 'u') or now)
+        tokens = math.min(capacity, tokens + (now - updated) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 't', tostring(tokens), 'u', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, redis, prefix: str):
+        self.prefix = prefix
+        self._script = redis.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, capacity: int) -> float:
+        return float(await self._script(keys=[f"{self.prefix}:rl:{key}"], args=[rate, capacity]))
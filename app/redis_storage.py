@@ -0,0 +1,107 @@
+import json
+import os
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, DEFAULT_DESTINY
+from dotenv import load_dotenv
+# Асинхронный клиент Redis (пакет redis уже есть в requirements.txt)
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+
+from app.sqlite_storage import _serialize_state
+
+load_dotenv()
+
+# Настройки хранилища FSM в Redis (можно переопределить через .env)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_REDIS_PREFIX = os.getenv("FSM_REDIS_PREFIX", "fsm")
+# Время жизни записи FSM после последнего изменения, сек. (0 - без ограничения)
+FSM_REDIS_TTL = int(os.getenv("FSM_REDIS_TTL", str(90 * 24 * 60 * 60)))
+
+
+class RedisStorage(BaseStorage):
+    """FSM-хранилище в Redis: общее для нескольких процессов бота (polling/webhook-воркеров)"""
+
+    def __init__(self, redis: Redis, prefix: str = FSM_REDIS_PREFIX, ttl: int = FSM_REDIS_TTL):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisStorage":
+        return cls(Redis.from_url(url, decode_responses=True), **kwargs)
+
+    def _key(self, key: StorageKey) -> str:
+        # Состояние и данные одного пользователя лежат в одном hash: fsm:{bot}:{chat}:{user}
+        parts = [self.prefix, str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.destiny != DEFAULT_DESTINY:
+            parts.append(key.destiny)
+        return ":".join(parts)
+
+    def _expire(self, pipe, redis_key: str):
+        if self.ttl:
+            pipe.expire(redis_key, self.ttl)
+
+    async def set_state(self, key: StorageKey, state: State | str | None = None):
+        redis_key = self._key(key)
+        serialized = _serialize_state(state)
+        # Запись и продление TTL уходят на сервер одним пакетом (один сетевой round trip)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if serialized is None:
+                pipe.hdel(redis_key, "state")
+            else:
+                pipe.hset(redis_key, "state", serialized)
+            self._expire(pipe, redis_key)
+            await pipe.execute()
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return await self.redis.hget(self._key(key), "state")
+
+    async def set_data(self, key: StorageKey, data: dict):
+        redis_key = self._key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(redis_key, "data", json.dumps(data))
+            self._expire(pipe, redis_key)
+            await pipe.execute()
+
+    async def get_data(self, key: StorageKey) -> dict:
+        raw = await self.redis.hget(self._key(key), "data")
+        return json.loads(raw) if raw else {}
+
+    async def update_data(self, key: StorageKey, data: dict) -> dict:
+        redis_key = self._key(key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    # Оптимистичная блокировка: если другой воркер изменит запись, повторим
+                    await pipe.watch(redis_key)
+                    raw = await pipe.hget(redis_key, "data")
+                    current = json.loads(raw) if raw else {}
+                    current.update(data)
+                    pipe.multi()
+                    pipe.hset(redis_key, "data", json.dumps(current))
+                    self._expire(pipe, redis_key)
+                    await pipe.execute()
+                    return current
+                except WatchError:
+                    continue
+
+    async def bulk_set(self, keys: list[StorageKey], state: State | str | None, data: dict):
+        """Устанавливает одно и то же состояние и данные многим записям одной транзакцией MULTI"""
+        serialized, payload = _serialize_state(state), json.dumps(data)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key in keys:
+                redis_key = self._key(key)
+                if serialized is None:
+                    pipe.hdel(redis_key, "state")
+                else:
+                    pipe.hset(redis_key, "state", serialized)
+                pipe.hset(redis_key, "data", payload)
+                self._expire(pipe, redis_key)
+            await pipe.execute()
+
+    async def flush(self):
+        pass  # Redis записывает изменения сразу, буфера в памяти нет
+
+    async def close(self):
+        await self.redis.aclose()
@@ -1,9 +1,33 @@
+import asyncio
 import json
+import logging
 import os
 import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from aiogram.fsm.storage.base import BaseStorage, StorageKey
 from aiogram.fsm.state import State
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки SQLite (можно переопределить через .env)
+SQLITE_MMAP_SIZE = int(os.getenv("FSM_SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))  # отображение файла в память, байт
+SQLITE_CACHE_SIZE = int(os.getenv("FSM_SQLITE_CACHE_SIZE", "-16000"))  # кэш страниц (отрицательное значение - КиБ)
+SQLITE_BUSY_TIMEOUT = int(os.getenv("FSM_SQLITE_BUSY_TIMEOUT", "5000"))  # ожидание блокировки, мс
+
+# Настройки кэша FSM в памяти
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # сколько записей (chat_id, user_id) держать в памяти
+FSM_FLUSH_INTERVAL_MS = int(os.getenv("FSM_FLUSH_INTERVAL_MS", "200"))  # как часто сбрасывать изменения на диск
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "100"))  # сброс без ожидания таймера при стольких изменениях
+# Надёжность записи:
+# "batch" - изменения копятся в памяти и пишутся пачкой (при падении теряется не более FSM_FLUSH_INTERVAL_MS)
+# "sync"  - каждое изменение сразу записывается на диск (write-through), кэш используется только для чтения
+FSM_DURABILITY = os.getenv("FSM_DURABILITY", "batch").lower()
 
 
 def _serialize_state(state: State | str | None) -> str | None:
@@ -13,8 +37,22 @@ def _serialize_state(state: State | str | None) -> str | None:
     return state.state if isinstance(state, State) else str(state)
 
 
+class _Record:
+    """Закэшированная запись FSM: состояние, данные и признак несохранённых изменений"""
+    __slots__ = ("state", "data", "dirty")
+
+    def __init__(self, state: str | None, data: dict):
+        self.state = state
+        self.data = data
+        self.dirty = False
+
+
 class SQLiteStorage(BaseStorage):
-    def __init__(self, db_path: Path = None):
+    def __init__(self, db_path: Path = None,
+                 cache_size: int = FSM_CACHE_SIZE,
+                 flush_interval_ms: int = FSM_FLUSH_INTERVAL_MS,
+                 flush_batch: int = FSM_FLUSH_BATCH,
+                 durability: str = FSM_DURABILITY):
         # Если путь не указан, используем стандартное расположение (рядом с main.py)
         if db_path is None:
             # Поднимаемся на уровень выше (из app/ в корень)
@@ -22,20 +60,52 @@ class SQLiteStorage(BaseStorage):
             self.db_path = Path(base_dir) / "states.db"
         else:
             self.db_path = Path(db_path)
-        self._init_db()
+        # Вся работа с SQLite идёт в одном выделенном потоке, event loop никогда не блокируется
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn: sqlite3.Connection | None = None
+
+        # Write-behind кэш: горячие записи читаются из памяти, изменения пишутся пачками
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_batch = flush_batch
+        self.durability = durability
+        self._cache: OrderedDict[tuple[int, int], _Record] = OrderedDict()
+        self._dirty: set[tuple[int, int]] = set()
+        # Выполняющиеся чтения из БД: параллельные промахи по одному ключу ждут один запрос
+        self._loading: dict[tuple[int, int], asyncio.Future] = {}
+        self._flusher: asyncio.Task | None = None
+
+        # Инициализация выполняется один раз при старте, поэтому дожидаемся её синхронно
+        self._executor.submit(self._init_db).result()
+
+    async def _run(self, func, *args):
+        """Выполняет func(*args) в потоке SQLite"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
 
     async def debug_state(self, key: StorageKey):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
+        def query(chat_id, user_id):
+            cursor = self._conn.execute(
                 "SELECT state, data FROM fsm_states WHERE chat_id=? AND user_id=?",
-                (key.chat_id, key.user_id)
+                (chat_id, user_id)
             )
             return cursor.fetchone()
+        return await self._run(query, key.chat_id, key.user_id)
 
     def _init_db(self):
-        """Инициализация таблицы в БД"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
+        """Открывает постоянное соединение и инициализирует таблицу в БД"""
+        # Соединение живёт в потоке executor'а и используется только из него
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # WAL: читатели не блокируют писателя, а коммит не требует fsync всего файла
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL synchronous=NORMAL безопасен для целостности и заметно быстрее FULL
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        self._conn.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        self._conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
+        with self._conn:
+            self._conn.execute("""
                 CREATE TABLE IF NOT EXISTS fsm_states (
                     chat_id INTEGER NOT NULL,
                     user_id INTEGER NOT NULL,
@@ -45,65 +115,226 @@ class SQLiteStorage(BaseStorage):
                 )
             """)
 
-    async def set_state(self, key: StorageKey, state: State | str | None = None):
-        serialized_state = _serialize_state(state)
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
+    def _fetch(self, chat_id: int, user_id: int) -> tuple[str | None, dict]:
+        """Состояние и данные одной записи - одним запросом"""
+        cursor = self._conn.execute(
+            "SELECT state, data FROM fsm_states WHERE chat_id=? AND user_id=?",
+            (chat_id, user_id)
+        )
+        row = cursor.fetchone()
+        if not row:
+            return None, {}
+        return row[0], json.loads(row[1]) if row[1] else {}
+
+    def _returning(self, sql: str, params: tuple) -> tuple[str | None, dict]:
+        """Выполняет upsert с RETURNING state, data в отдельной транзакции"""
+        with self._conn:
+            row = self._conn.execute(sql, params).fetchone()
+        return row[0], json.loads(row[1]) if row[1] else {}
+
+    def _upsert_state(self, chat_id: int, user_id: int, state: str | None):
+        return self._returning("""
+            INSERT INTO fsm_states (chat_id, user_id, state, data)
+            VALUES (?, ?, ?, '{}')
+            ON CONFLICT(chat_id, user_id) DO UPDATE
+              SET state=excluded.state
+            RETURNING state, data
+        """, (chat_id, user_id, state))
+
+    def _upsert_data(self, chat_id: int, user_id: int, serialized: str):
+        return self._returning("""
+            INSERT INTO fsm_states (chat_id, user_id, state, data)
+            VALUES (?, ?, NULL, ?)
+            ON CONFLICT(chat_id, user_id) DO UPDATE
+              SET data=excluded.data
+            RETURNING state, data
+        """, (chat_id, user_id, serialized))
+
+    def _merge_data(self, chat_id: int, user_id: int, data: dict):
+        """Атомарный update_data одним запросом: ключи из data записываются в JSON поверх старых"""
+        # json_set (а не json_patch) - поверхностное слияние как у dict.update, null не удаляет ключ
+        paths = ", ".join("?, json(?)" for _ in data)
+        params = [chat_id, user_id, json.dumps(data)]
+        for k, v in data.items():
+            params += [f'$."{k}"', json.dumps(v)]
+        return self._returning(f"""
+            INSERT INTO fsm_states (chat_id, user_id, state, data)
+            VALUES (?, ?, NULL, ?)
+            ON CONFLICT(chat_id, user_id) DO UPDATE
+              SET data=json_set(COALESCE(fsm_states.data, '{{}}'), {paths})
+            RETURNING state, data
+        """, tuple(params))
+
+    def _write(self, rows: list[tuple[int, int, str | None, str]]):
+        """Записывает пачку записей одной транзакцией"""
+        with self._conn:
+            self._conn.executemany("""
                 INSERT INTO fsm_states (chat_id, user_id, state, data)
-                VALUES (?, ?, ?, COALESCE(
-                    (SELECT data FROM fsm_states WHERE chat_id=? AND user_id=?), '{}'
-                ))
+                VALUES (?, ?, ?, ?)
                 ON CONFLICT(chat_id, user_id) DO UPDATE
-                  SET state=excluded.state
-            """, (
-                key.chat_id, key.user_id, serialized_state,
-                key.chat_id, key.user_id
-            ))
-            conn.commit()
+                  SET state=excluded.state, data=excluded.data
+            """, rows)
+
+    async def _cached(self, ckey: tuple[int, int]) -> _Record | None:
+        """Запись из кэша (дождавшись идущего по этому ключу запроса) или None"""
+        while True:
+            record = self._cache.get(ckey)
+            if record is not None:
+                self._cache.move_to_end(ckey)
+                return record
+            loading = self._loading.get(ckey)
+            if loading is None:
+                return None
+            # По ключу уже идёт запрос другого обработчика - ждём его и смотрим в кэш снова
+            await asyncio.shield(loading)
+
+    async def _load(self, ckey: tuple[int, int], func, *args) -> _Record:
+        """Выполняет запрос func (чтение или upsert с RETURNING) и кладёт результат в кэш"""
+        loading = self._loading[ckey] = asyncio.ensure_future(self._run(func, *ckey, *args))
+        try:
+            state, data = await loading
+        finally:
+            del self._loading[ckey]
+        record = self._cache[ckey] = _Record(state, data)
+        self._evict(keep=ckey)
+        return record
+
+    async def _record(self, key: StorageKey) -> _Record:
+        """Снимок записи: состояние и данные загружаются одним запросом и переиспользуются
+        всеми, кто обрабатывает апдейт (FSM-middleware, фильтры состояний, обработчик)"""
+        ckey = (key.chat_id, key.user_id)
+        record = await self._cached(ckey)
+        if record is None:
+            record = await self._load(ckey, self._fetch)
+        return record
+
+    def _evict(self, keep: tuple[int, int] | None = None):
+        """Вытесняет самые старые записи без несохранённых изменений"""
+        while len(self._cache) > self.cache_size:
+            victim = next((ckey for ckey, rec in self._cache.items() if not rec.dirty and ckey != keep), None)
+            if victim is None:
+                return  # все записи ждут сброса на диск - вытесним после flush()
+            del self._cache[victim]
+
+    async def _mark_dirty(self, key: StorageKey, record: _Record):
+        record.dirty = True
+        self._dirty.add((key.chat_id, key.user_id))
+        if self.durability == "sync" or len(self._dirty) >= self.flush_batch:
+            await self.flush()
+        elif self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self._dirty:
+                # Изменений нет - останавливаемся до следующей записи
+                self._flusher = None
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка сброса FSM на диск: {e}")
+
+    async def flush(self):
+        """Записывает все несохранённые изменения на диск одной транзакцией"""
+        if not self._dirty:
+            return
+        rows = []
+        for ckey in self._dirty:
+            record = self._cache[ckey]
+            record.dirty = False
+            rows.append((*ckey, record.state, json.dumps(record.data)))
+        self._dirty.clear()
+        try:
+            await self._run(self._write, rows)
+        except BaseException:
+            # Запись не удалась (или отменена) - вернём изменения в очередь на следующий сброс
+            for chat_id, user_id, _, _ in rows:
+                record = self._cache.get((chat_id, user_id))
+                if record is not None:
+                    record.dirty = True
+                    self._dirty.add((chat_id, user_id))
+            raise
+        self._evict()
+
+    async def set_state(self, key: StorageKey, state: State | str | None = None):
+        ckey = (key.chat_id, key.user_id)
+        record = await self._cached(ckey)
+        if record is None:
+            # Записи нет в памяти - один upsert вместо чтения и последующей записи
+            await self._load(ckey, self._upsert_state, _serialize_state(state))
+            return
+        record.state = _serialize_state(state)
+        await self._mark_dirty(key, record)
 
     async def get_state(self, key: StorageKey) -> str | None:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                """
-                SELECT state FROM fsm_states
-                WHERE chat_id = ? AND user_id = ?
-                """,
-                (key.chat_id, key.user_id)
-            )
-            result = cursor.fetchone()
-            return result[0] if result else None
+        return (await self._record(key)).state
 
     async def set_data(self, key: StorageKey, data: dict):
-        serialized = json.dumps(data)
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT INTO fsm_states (chat_id, user_id, state, data)
-                VALUES (?, ?, COALESCE(
-                    (SELECT state FROM fsm_states WHERE chat_id=? AND user_id=?), NULL
-                ), ?)
-                ON CONFLICT(chat_id, user_id) DO UPDATE
-                  SET data=excluded.data
-            """, (
-                key.chat_id, key.user_id,
-                key.chat_id, key.user_id,
-                serialized
-            ))
-            conn.commit()
+        ckey = (key.chat_id, key.user_id)
+        record = await self._cached(ckey)
+        if record is None:
+            await self._load(ckey, self._upsert_data, json.dumps(data))
+            return
+        record.data = dict(data)
+        await self._mark_dirty(key, record)
 
     async def get_data(self, key: StorageKey) -> dict:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                "SELECT data FROM fsm_states WHERE chat_id=? AND user_id=?",
-                (key.chat_id, key.user_id)
-            )
-            row = cursor.fetchone()
-            return json.loads(row[0]) if row and row[0] else {}
+        # Возвращаем копию, чтобы изменения словаря в обработчике не попали в кэш мимо set_data
+        return dict((await self._record(key)).data)
 
     async def update_data(self, key: StorageKey, data: dict) -> dict:
-        current = await self.get_data(key)  # получаем уже сохранённые данные
-        current.update(data)  # обновляем словарь
-        await self.set_data(key, current)  # сохраняем обратно
-        return current  # возвращаем обновлённый словарь
+        ckey = (key.chat_id, key.user_id)
+        record = await self._cached(ckey)
+        if record is None and data and all(isinstance(k, str) and '"' not in k for k in data):
+            # Записи нет в памяти - слияние выполняет сама SQLite одним атомарным запросом
+            record = await self._load(ckey, self._merge_data, data)
+            return dict(record.data)
+        if record is None:
+            record = await self._load(ckey, self._fetch)
+        record.data.update(data)  # обновляем словарь (без await между чтением и записью - атомарно)
+        await self._mark_dirty(key, record)  # сохраняем обратно
+        return dict(record.data)  # возвращаем обновлённый словарь
+
+    async def bulk_set(self, keys: list[StorageKey], state: State | str | None, data: dict):
+        """Устанавливает одно и то же состояние и данные многим записям одной транзакцией"""
+        serialized, payload = _serialize_state(state), json.dumps(data)
+        rows = []
+        for key in keys:
+            ckey = (key.chat_id, key.user_id)
+            # Дожидаемся идущих чтений, чтобы они не вернули в кэш старое значение после записи
+            record = await self._cached(ckey)
+            if record is not None:
+                record.state, record.data, record.dirty = serialized, dict(data), False
+                self._dirty.discard(ckey)
+            rows.append((*ckey, serialized, payload))
+        try:
+            await self._run(self._write, rows)
+        except BaseException:
+            # Не записалось - оставляем изменения в кэше, их сохранит следующий flush()
+            for chat_id, user_id, _, _ in rows:
+                ckey = (chat_id, user_id)
+                record = self._cache.get(ckey)
+                if record is None:
+                    record = self._cache[ckey] = _Record(serialized, dict(data))
+                record.dirty = True
+                self._dirty.add(ckey)
+            raise
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
     async def close(self):
-        pass  # SQLite автоматически управляет соединениями
+        # Останавливаем фоновый сброс и записываем всё, что осталось в памяти
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._conn is not None:
+            await self.flush()
+        # Закрываем постоянное соединение в его же потоке и останавливаем поток
+        if self._conn is not None:
+            await self._run(self._close)
+        self._executor.shutdown(wait=False)
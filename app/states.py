@@ -0,0 +1,20 @@
+# Состояния FSM бота: общие для обработчиков (handlers.py) и middleware (throttling.py)
+from aiogram.fsm.state import State, StatesGroup
+
+
+# Устанавливаем кастомные состояния
+class UserStates(StatesGroup):
+    start = State()
+    login = State()  # Ввод логина
+    password = State()  # Ввод пароля
+    auth_confirmed = State()  # Успешная авторизация
+    banned = State()  # Пользователь больше не авторизован
+
+
+# Состояния для админа (добавление/удаление пользователя)
+class AdminStates(StatesGroup):
+    login = State()
+    admin = State()
+    waiting_for_new_user = State()
+    waiting_for_user_to_remove = State()
+    waiting_for_user_file = State()
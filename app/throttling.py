@@ -0,0 +1,78 @@
+import logging
+import math
+import os
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from dotenv import load_dotenv
+
+from app.states import AdminStates, UserStates
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Лимиты сообщений: (сообщений в минуту, сколько можно прислать разом) - для одного пользователя роли
+RATE_LIMITS = {
+    "admin": (float(os.getenv("RATE_LIMIT_ADMIN_PER_MIN", "60")), int(os.getenv("RATE_LIMIT_ADMIN_BURST", "20"))),
+    "user": (float(os.getenv("RATE_LIMIT_USER_PER_MIN", "10")), int(os.getenv("RATE_LIMIT_USER_BURST", "5"))),
+    # ещё не авторизован: вход с опечатками в логине и коде
+    "guest": (float(os.getenv("RATE_LIMIT_GUEST_PER_MIN", "20")), int(os.getenv("RATE_LIMIT_GUEST_BURST", "10"))),
+}
+# Общий лимит на всех пользователей роли (защищает ValueAI и Postgres от массового наплыва); у админов нет
+ROLE_LIMITS = {
+    "user": (float(os.getenv("RATE_LIMIT_USERS_TOTAL_PER_MIN", "300")), int(os.getenv("RATE_LIMIT_USERS_TOTAL_BURST", "50"))),
+    "guest": (float(os.getenv("RATE_LIMIT_GUESTS_TOTAL_PER_MIN", "300")), int(os.getenv("RATE_LIMIT_GUESTS_TOTAL_BURST", "50"))),
+}
+# Как часто повторять пользователю предупреждение о превышении лимита, сек.
+RATE_LIMIT_WARN_INTERVAL = float(os.getenv("RATE_LIMIT_WARN_INTERVAL", "10"))
+
+_ADMIN_STATES = {AdminStates.admin.state, AdminStates.waiting_for_new_user.state,
+                 AdminStates.waiting_for_user_to_remove.state, AdminStates.waiting_for_user_file.state}
+
+
+def _role(raw_state: str | None) -> str:
+    if raw_state in _ADMIN_STATES:
+        return "admin"
+    if raw_state == UserStates.auth_confirmed.state:
+        return "user"
+    return "guest"
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Не пропускает к обработчикам сообщения сверх лимита пользователя и его роли"""
+
+    def __init__(self, limiter):
+        # RateLimiter (память процесса) или RedisRateLimiter (общий для воркеров)
+        self.limiter = limiter
+        # user_id -> когда последний раз предупреждали о превышении лимита
+        self._warned: dict[int, float] = {}
+
+    async def __call__(self, handler, event: Message, data):
+        user = event.from_user
+        if user is None:
+            return await handler(event, data)
+
+        role = _role(data.get("raw_state"))
+        wait = await self.limiter.take(f"user:{user.id}", *self._per_second(RATE_LIMITS[role]))
+        if not wait and role in ROLE_LIMITS:
+            wait = await self.limiter.take(f"role:{role}", *self._per_second(ROLE_LIMITS[role]))
+        if not wait:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        # Предупреждаем один раз за интервал, чтобы ответы на спам сами не упирались в лимиты Telegram
+        if now - self._warned.get(user.id, 0.0) >= RATE_LIMIT_WARN_INTERVAL:
+            self._warned[user.id] = now
+            if len(self._warned) > 10000:
+                self._warned = {uid: t for uid, t in self._warned.items() if now - t < RATE_LIMIT_WARN_INTERVAL}
+            logger.info(f"Пользователь {user.id} ({role}) превысил лимит сообщений")
+            await event.answer(f"Слишком много сообщений. Подождите {math.ceil(wait)} сек. и повторите вопрос")
+        return None
+
+    @staticmethod
+    def _per_second(limit: tuple[float, int]) -> tuple[float, int]:
+        per_minute, burst = limit
+        return per_minute / 60, burst
@@ -1,14 +1,10 @@
 # Импорт стандартного модуля логирования для записи событий и ошибок
 # Позволяет выводить сообщения разных уровней (debug, info, warning, error, critical)
 import logging
+import asyncio
+import time
 from datetime import datetime
-
-# Импорт декораторов и стратегий из библиотеки tenacity для реализации повторных попыток (retry)
-# - retry: декоратор для повторного выполнения функции при ошибках
-# - wait_exponential: стратегия экспоненциального увеличения задержки между попытками
-# - stop_after_attempt: ограничение максимального количества попыток
-# - retry_if_exception_type: условие для повторных попыток только при определенных типах исключений
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+from functools import partial
 
 # Импорт библиотеки для асинхронных HTTP-запросов
 # Позволяет делать асинхронные запросы к API/веб-сервисам
@@ -17,6 +13,12 @@ import aiohttp
 # Импорт собственного класса AuthManager из модуля auth_manager
 # (содержит логику аутентификации на ValueAI и работы с токенами)
 from app.auth_valueai import AuthValuai
+from app.http_session import HTTPSessionManager
+from app.answer_cache import AnswerCache
+from app.chat_cleanup import ChatCleanupQueue
+from app.answer_polling import AnswerPollScheduler, POLL_MAX_SERVER_ERRORS
+from app.circuit_breaker import CircuitBreaker
+from app.hedging import Hedger
 
 # Настройка базовой конфигурации логирования для всего приложения:
 logging.basicConfig(level=logging.INFO)
@@ -26,14 +28,48 @@ logger = logging.getLogger(__name__)
 
 class APIError(Exception):
     """Кастомное исключение для ошибок API"""
-    pass
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        # HTTP-статус ответа ValueAI (None - ответ получен, но в нём нет нужных данных)
+        self.status = status
+
+
+# Статусы, при которых опрос ответа продолжается: сервер просит подождать
+POLL_RETRY_STATUSES = {408, 409, 425, 429}
+# Отказ в доступе: проблема токена, а не здоровья ValueAI
+AUTH_STATUSES = {401, 403}
+
+
+def is_service_failure(error: Exception) -> bool:
+    """Считать ли ошибку сбоем ValueAI для автомата защиты"""
+    return not (isinstance(error, APIError) and error.status in AUTH_STATUSES)
 
 
 class ValueAIClient:
-    def __init__(self, auth_manager: AuthValuai):
+    def __init__(self, auth_manager: AuthValuai, http: HTTPSessionManager | None = None,
+                 cache: AnswerCache | None = None):
         self.auth_manager = auth_manager
+        # По умолчанию используем ту же HTTP-сессию, что и менеджер аутентификации
+        self.http = http or auth_manager.http
+        # Кэш ответов на уже заданные (с точностью до регистра/пунктуации) вопросы
+        self.cache = cache if cache is not None else AnswerCache()
+        # Чаты удаляются в фоне, пользователь ждёт только получение ответа
+        self.chat_cleanup = ChatCleanupQueue(self)
+        # Расписание опроса готовности ответа (учится на времени прошлых ответов)
+        self.poller = AnswerPollScheduler()
+        # При массовых ошибках ValueAI перестаём к нему обращаться и сразу отвечаем ServiceDegraded
+        self.breaker = CircuitBreaker("ValueAI", is_failure=is_service_failure)
+        # Дублирование зависших этапов запроса (HEDGE_ENABLED)
+        self.hedger = Hedger()
         self.base_url = "https://ml-request-prod.wavea.cc/api/external/v1/"
 
+    async def start(self):
+        await self.chat_cleanup.start()
+
+    async def close(self):
+        await self.chat_cleanup.close()
+
     async def get_headers(self) -> dict:
         start = datetime.now()
         token = await self.auth_manager.get_valid_token()
@@ -44,25 +80,61 @@ class ValueAIClient:
             "Authorization": f"Bearer {token}"
         }
 
-    @retry(
-        wait=wait_exponential(multiplier=0.5, min=0.5, max=4),
-        stop=stop_after_attempt(8),
-        retry=retry_if_exception_type((aiohttp.ClientError, APIError))
-    )
+    async def reauthorize(self, headers: dict) -> dict:
+        """Заголовки с новым токеном вместо отклонённого сервером (401)"""
+        rejected = headers["Authorization"].removeprefix("Bearer ")
+        token = await self.auth_manager.renew_token(rejected)
+        return {
+            "Authorization": f"Bearer {token}"
+        }
+
+    async def wait_for_answer(self, chat_url: str, headers: dict) -> str:
+        """Опрашивает чат по расписанию poller, пока не появится ответ или не истечёт deadline"""
+        start = time.monotonic()
+        polls = 0
+        server_errors = 0
+        last_error = None
+        for offset in self.poller.schedule():
+            delay = start + offset - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            polls += 1
+            try:
+                answer = await self.get_chat_response(chat_url, headers)
+            except APIError as e:
+                if e.status is not None and e.status not in POLL_RETRY_STATUSES:
+                    # 401/403/404 и т.п. не исправятся до deadline; 5xx - допускаем несколько подряд
+                    server_errors += 1
+                    if e.status < 500 or server_errors >= POLL_MAX_SERVER_ERRORS:
+                        raise
+                else:
+                    server_errors = 0
+                # Ответ ещё не готов - ждём следующего опроса
+                last_error = e
+                continue
+            except aiohttp.ClientError as e:
+                # Временная ошибка сети - ждём следующего опроса
+                last_error = e
+                continue
+            elapsed = time.monotonic() - start
+            self.poller.record(elapsed, polls)
+            logger.info(f"Ответ получен за {elapsed:.2f} сек., опросов: {polls}")
+            return answer
+        raise APIError(f"Ответ не получен за {self.poller.deadline} сек. ({polls} опросов): {last_error}")
+
     async def get_chat_response(self, chat_url: str, headers: dict) -> str:
         start = datetime.now()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(chat_url, headers=headers) as response:
-                if response.status != 200:
-                    error = await response.text()
-                    raise APIError(f"Ошибка получения ответа: {error}")
-                data = await response.json()
-                logger.debug(f"data: {data}")
-                try:
-                    result = data['data'][0]['text']
-                except (KeyError, IndexError):
-                    raise APIError("Ответ LLM не найден в истории")
+        async with self.http.session.get(chat_url, headers=headers) as response:
+            if response.status != 200:
+                error = await response.text()
+                raise APIError(f"Ошибка получения ответа ({response.status}): {error}", response.status)
+            data = await response.json()
+            logger.debug(f"data: {data}")
+            try:
+                result = data['data'][0]['text']
+            except (KeyError, IndexError):
+                raise APIError("Ответ LLM не найден в истории")
 
         end = datetime.now()
         duration = round((end - start).total_seconds(), 3)
@@ -70,14 +142,49 @@ class ValueAIClient:
 
         return result
 
+    async def create_chat(self, url: str, payload: dict, headers: dict) -> str:
+        """Создаёт чат с вопросом и возвращает его адрес"""
+        async with self.http.session.post(url, json=payload, headers=headers) as response:
+            if response.status != 200:
+                raise APIError(f"Ошибка создания чата: {response.status}", response.status)
+            data = await response.json()
+            chat_id = data['id']
+            logger.info(f'Чат создан: {chat_id}')
+        return f"{url}/{chat_id}"
+
     async def send_message_to_llm(self, message: str) -> str:
+        # Повторный вопрос отдаём из кэша, не обращаясь к LLM
+        cached = self.cache.get(message)
+        if cached is not None:
+            logger.info("Ответ взят из кэша")
+            return cached
+        answer, _ = await self.request_llm(message)
+        return answer
+
+    async def request_llm(self, message: str) -> tuple[str, float]:
+        """Запрос к LLM в обход кэша (ответ в кэш сохраняется).
+        Возвращает (ответ, сколько секунд ValueAI готовил ответ после создания чата)"""
+        answer, llm_time = await self.breaker.call(self._request_llm, message)
+        self.cache.set(message, answer)
+        return answer, llm_time
+
+    async def _request_llm(self, message: str) -> tuple[str, float]:
+        headers = await self.get_headers()
+        try:
+            return await self._ask_llm(message, headers)
+        except APIError as e:
+            if e.status != 401:
+                raise
+        # Токен отозван или истёк раньше срока из кэша: обновляем его и повторяем запрос один раз
+        return await self._ask_llm(message, await self.reauthorize(headers))
+
+    async def _ask_llm(self, message: str, headers: dict) -> tuple[str, float]:
         # Профилирование времени
         timers = {
             'start': datetime.now(),
         }
 
         url = f"{self.base_url}chat"
-        headers = await self.get_headers()
 
         payload = {
             "trained_model_id": 1,
@@ -105,52 +212,65 @@ class ValueAIClient:
             }
         }
 
+        # Все чаты этого вопроса (основной и созданные дублями) - удаляются после ответа
+        chat_urls = []
+        finished = False
+
+        def remember_chat(chat_url: str):
+            # Дубль может создать чат уже после того, как ответ получен, - тогда удаляем сразу
+            if finished:
+                self.chat_cleanup.schedule(chat_url)
+            else:
+                chat_urls.append(chat_url)
+
+        def create_chat():
+            return self.create_chat(url, payload, headers)
+
+        async def answer_in_new_chat():
+            # Дубль этапа ответа - тот же вопрос в новом чате. Создание чата не прерываем,
+            # иначе созданный на сервере чат останется без удаления
+            creation = asyncio.ensure_future(create_chat())
+            creation.add_done_callback(
+                lambda task: remember_chat(task.result()) if not task.cancelled() and not task.exception() else None
+            )
+            return await self.wait_for_answer(await asyncio.shield(creation), headers)
+
         try:
-            async with aiohttp.ClientSession() as session:
-                # 1. Создание чата
-                timers['create_chat_start'] = datetime.now()
-                async with session.post(url, json=payload, headers=headers) as response:
-                    if response.status != 200:
-                        raise APIError(f"Ошибка создания чата: {response.status}")
-                    data = await response.json()
-                    chat_id = data['id']
-                    logger.info(f'Чат создан: {chat_id}')
-                timers['create_chat_end'] = datetime.now()
-
-                # 2. Получение ответа
-                timers['get_response_start'] = datetime.now()
-                chat_url = f"{url}/{chat_id}"
-                answer = await self.get_chat_response(chat_url, headers)
-                timers['get_response_end'] = datetime.now()
-
-                # 3. Удаление чата
-                timers['delete_chat_start'] = datetime.now()
-                async with session.delete(chat_url, headers=headers) as response:
-                    if response.status != 200:
-                        logger.warning(f'Ошибка удаления чата: {response.status}')
-                    else:
-                        logger.info('Чат успешно удален')
-                timers['delete_chat_end'] = datetime.now()
-
-                # 4. Конец
-                timers['end'] = datetime.now()
-
-                # Печать профилирования
-                total = (timers['end'] - timers['start']).total_seconds()
-                create_chat = (timers['create_chat_end'] - timers['create_chat_start']).total_seconds()
-                get_response = (timers['get_response_end'] - timers['get_response_start']).total_seconds()
-                delete_chat = (timers['delete_chat_end'] - timers['delete_chat_start']).total_seconds()
-
-                logger.debug(
-                    "\n=== Профилирование send_message_to_llm ==="
-                    f"1. Создание чата: {create_chat:.2f} сек. ({create_chat/total*100:.1f}%)"
-                    f"2. Получение ответа: {get_response:.2f} сек. ({get_response/total*100:.1f}%)"
-                    f"3. Удаление чата: {delete_chat:.2f} сек. ({delete_chat/total*100:.1f}%)"
-                    f"4. Общее время: {total:.2f} сек."
-                    "==========================================\n")
-
-                return answer
+            # 1. Создание чата (проигравший дубль дорабатывает, и его чат удаляется)
+            timers['create_chat_start'] = datetime.now()
+            chat_url = await self.hedger.run("create", create_chat, discard=self.chat_cleanup.schedule)
+            chat_urls.append(chat_url)
+            timers['create_chat_end'] = datetime.now()
+
+            # 2. Получение ответа
+            timers['get_response_start'] = datetime.now()
+            answer = await self.hedger.run("answer", partial(self.wait_for_answer, chat_url, headers),
+                                           hedge=answer_in_new_chat)
+            timers['get_response_end'] = datetime.now()
+
+            # 3. Конец (чат удаляется в фоне, см. finally)
+            timers['end'] = datetime.now()
+
+            # Печать профилирования
+            total = (timers['end'] - timers['start']).total_seconds()
+            create_chat_time = (timers['create_chat_end'] - timers['create_chat_start']).total_seconds()
+            get_response = (timers['get_response_end'] - timers['get_response_start']).total_seconds()
+
+            logger.debug(
+                "\n=== Профилирование _ask_llm ==="
+                f"1. Создание чата: {create_chat_time:.2f} сек. ({create_chat_time/total*100:.1f}%)"
+                f"2. Получение ответа: {get_response:.2f} сек. ({get_response/total*100:.1f}%)"
+                f"3. Общее время: {total:.2f} сек."
+                "==========================================\n")
+
+            return answer, get_response
 
         except Exception as e:
             logger.error(f"Ошибка при работе с API: {str(e)}")
             raise
+
+        finally:
+            # Удаление чатов ставим в фоновую очередь - даже если ответ получить не удалось
+            finished = True
+            for chat_url in chat_urls:
+                self.chat_cleanup.schedule(chat_url)
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Настройки приёма обновлений через webhook (BOT_MODE=webhook в main.py)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")  # адрес, на котором слушает aiohttp
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Публичный адрес (https://bot.example.com) - если задан, webhook регистрируется в Telegram при старте.
+# Без него сервер только принимает POST-запросы (локальная проверка, webhook настроен вручную)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: запросы без него отклоняются
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+HEALTH_PATH = "/healthz"
+
+
+def create_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp-приложение: приём обновлений и проверка живости для балансировщика"""
+    app = web.Application()
+
+    # handle_in_background: Telegram сразу получает 200, апдейт обрабатывается отдельной задачей,
+    # поэтому медленный ответ LLM не задерживает доставку следующих обновлений
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True, secret_token=WEBHOOK_SECRET)
+    handler.register(app, path=WEBHOOK_PATH)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    app.router.add_get(HEALTH_PATH, health)
+    # Запуск и остановка диспетчера (startup/shutdown, закрытие хранилища FSM) вместе с приложением
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, stop: asyncio.Event | None = None):
+    """Запускает webhook-сервер и работает до SIGTERM/SIGINT (или stop.set())"""
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    runner = web.AppRunner(create_app(dp, bot))
+    await runner.setup()
+    # Как и start_polling, завершаемся штатно по сигналу (docker stop): main() успевает
+    # дописать FSM и статистику, удалить чаты ValueAI и отправить письма из очереди
+    signals = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+            signals.append(sig)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows или не главный поток - обработчики сигналов недоступны
+
+    try:
+        site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+        await site.start()
+        logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+        if WEBHOOK_URL:
+            # Несколько воркеров за балансировщиком регистрируют один и тот же адрес - это безопасно
+            await bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+        await stop.wait()
+        logger.info("Webhook-сервер останавливается...")
+    finally:
+        for sig in signals:
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
@@ -4,6 +4,7 @@
 # его позже, не теряя контекст. Они используются для асинхронного программирования и позволяют эффективно
 # работать с I/O-операциями (сетевые запросы, чтение файлов и т.д.), не блокируя основной поток.
 import asyncio
+from functools import partial
 
 # Библиотека с методами для логирования различного типа
 import logging
@@ -15,6 +16,10 @@ from aiogram import Bot, Dispatcher, BaseMiddleware
 
 from app.issue_statistics import Database
 from app.sqlite_storage import SQLiteStorage
+from app.redis_storage import RedisStorage
+from app.webhook import run_webhook
+from app.rate_limit import RateLimiter, RedisRateLimiter
+from app.throttling import RateLimitMiddleware
 
 # Модуль стандартной библиотеки Python для работы с операционной системой
 # Используется для доступа к переменным окружения, путям файлов и т.д.
@@ -26,7 +31,8 @@ from dotenv import load_dotenv
 
 # Импорт роутера из вашего приложения
 # Содержит обработчики сообщений и команд для бота
-from app.handlers import router
+from app.handlers import (router, http_session, auth_manager, valueai_client, faq_index, apply_auth_change,
+                          email_sender, outbound, llm_scheduler)
 from config import FSM_DB_PATH
 
 load_dotenv()  # Функция load_dotenv() из библиотеки python-dotenv загружает переменные окружения
@@ -52,6 +58,13 @@ DB_NAME = os.getenv("DB_NAME")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 
+# Хранилище FSM: "sqlite" (локальный файл, один процесс) или "redis" (общее для нескольких воркеров)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+# Лимиты сообщений пользователей в Redis - общие для всех процессов бота (только при FSM_STORAGE=redis)
+RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "false").lower() == "true"
+# Приём обновлений: "polling" (бот сам опрашивает Telegram) или "webhook" (Telegram присылает их на aiohttp-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
 
 class AuthBotMiddleware(BaseMiddleware):
     def __init__(self, auth_bot: Database):
@@ -72,33 +85,79 @@ async def main():
 
     # В этом коде инициализируются основные компоненты для работы бота на aiogram 3.x.
     bot = Bot(token=bot_token)  # Создаётся экземпляр класса Bot, который отвечает за взаимодействие с Telegram Bot API
+    # Исходящие запросы идут через очередь с лимитами Telegram (flood control, приоритет ответов)
+    bot.session.middleware(outbound)
     # storage = MemoryStorage()  # Создаётся хранилище состояний (FSM — Finite State Machine) в оперативной памяти
 
-    storage = SQLiteStorage(db_path=FSM_DB_PATH)  # Хранилище в оперативной памяти - явно передаем путь
+    if FSM_STORAGE == "redis":
+        storage = RedisStorage.from_url()  # Общее хранилище в Redis (адрес берётся из REDIS_URL)
+    else:
+        storage = SQLiteStorage(db_path=FSM_DB_PATH)  # Хранилище в оперативной памяти - явно передаем путь
     dp = Dispatcher(storage=storage)  # Создаётся диспетчер (Dispatcher) — центральный компонент aiogram, который:
     # принимает обновления от Telegram (сообщения, команды, колбэки), перенаправляет их в ваши обработчики (роутеры).
     # Telegram --> Bot --> Dispatcher --> Router --> Handlers
 
     auth_bot = Database(DB_USER, DB_PASSWORD, DB_NAME, DB_HOST, DB_PORT)
+    # Отзыв доступа, сделанный любым процессом бота, сразу применяется к FSM этого процесса
+    auth_bot.add_auth_listener(partial(apply_auth_change, storage, bot.id))
 
     await auth_bot.connect()
     print(auth_bot.pool)
 
+    # Строим FAQ-индекс по уже отвеченным вопросам и дополняем его новыми ответами
+    await faq_index.load(auth_bot)
+    auth_bot.add_statistics_listener(faq_index.add)
+    # Расписание опроса ответа ValueAI стартует с распределения прошлых времён ответа
+    await valueai_client.poller.load(auth_bot)
+    # Порог дублирования ответа ValueAI (если HEDGE_ENABLED) - по тем же временам
+    await valueai_client.hedger.load(auth_bot, "answer")
+
+    # Открываем общий пул HTTP-соединений к ValueAI (один на всё время работы бота)
+    await http_session.start()
+    # Фоновое обновление токена ValueAI: запросы пользователей берут токен из кэша
+    await auth_manager.start()
+    # Фоновое удаление использованных чатов ValueAI
+    await valueai_client.start()
+    # Отправка писем с кодами авторизации (одно SMTP-соединение на процесс)
+    await email_sender.start()
+
     dp.update.middleware(AuthBotMiddleware(auth_bot))
+    # Лимит частоты сообщений проверяется до фильтров и обработчиков: лишние вопросы не доходят до ValueAI и БД
+    if RATE_LIMIT_SHARED and FSM_STORAGE == "redis":
+        limiter = RedisRateLimiter(storage.redis, storage.prefix)
+    else:
+        limiter = RateLimiter()
+    dp.message.outer_middleware(RateLimitMiddleware(limiter))
     dp.include_router(router)  # Подключает роутер (группу обработчиков) к диспетчеру бота
 
     # Запуск бота
     try:
         logger.info("Бот запущен...")
 
-        # начинаем поллинг: бот часто обращается к Telegram и спрашивает, не пришло ли обновление
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            # Telegram сам присылает обновления; можно запускать несколько воркеров за балансировщиком
+            await run_webhook(dp, bot)
+        else:
+            # Если раньше бот работал через webhook, getUpdates вернёт конфликт - снимаем его
+            await bot.delete_webhook()
+            # начинаем поллинг: бот часто обращается к Telegram и спрашивает, не пришло ли обновление
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка: {e}")
 
     # Завершение работы бота
     finally:
+        # Сначала перестаём получать события отзыва доступа: иначе правка FSM из обработчика события
+        # может прийти уже после flush и не попасть на диск
+        await auth_bot.auth_events.close()
+        await storage.flush()  # записываем на диск изменения FSM, накопленные в памяти
         await bot.session.close()  # освобождает ресурсы (HTTP-соединения)
+        await outbound.close()  # останавливаем очередь исходящих сообщений
+        await llm_scheduler.close()  # отменяем вопросы, ожидающие очереди к LLM
+        await valueai_client.close()  # дожидаемся удаления оставшихся чатов ValueAI
+        await email_sender.close()  # дожидаемся отправки писем и закрываем SMTP-соединение
+        await auth_manager.close()  # останавливаем фоновое обновление токена
+        await http_session.close()  # закрываем пул соединений к ValueAI
         await auth_bot.close()  # закрываем сессию бота
         logger.info("Бот отключён")
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Тесты запускаются из корня репозитория или из tests/ - модули app должны импортироваться в обоих случаях
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,129 @@
+import asyncio
+import socketserver
+import threading
+
+import app.email_key as email_key
+from app.email_key import EmailSender
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Минимальный SMTP-сервер: ответы на RCPT TO и конец DATA берутся из заданных очередей"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, rcpt_replies=(), data_replies=(), close_after_message=False):
+        super().__init__(("127.0.0.1", 0), FakeSMTPHandler)
+        self.rcpt_replies = list(rcpt_replies)
+        self.data_replies = list(data_replies)
+        self.close_after_message = close_after_message
+        self.received = []  # адреса получателей доставленных писем
+        self.connections = 0
+        self.rcpt_attempts = 0
+        self.data_attempts = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        self.reply("220 fake ESMTP")
+        recipient = None
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 fake")
+            elif command == "RCPT":
+                server.rcpt_attempts += 1
+                recipient = line.split(":", 1)[1].strip("<> ")
+                self.reply(server.rcpt_replies.pop(0) if server.rcpt_replies else "250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                server.data_attempts += 1
+                answer = server.data_replies.pop(0) if server.data_replies else "250 Queued"
+                self.reply(answer)
+                if answer.startswith("250"):
+                    server.received.append(recipient)
+                    if server.close_after_message:
+                        return  # сервер закрывает соединение, клиент об этом не знает
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:  # MAIL, RSET, NOOP
+                self.reply("250 OK")
+
+
+def make_sender(server: FakeSMTPServer) -> EmailSender:
+    return EmailSender(host="127.0.0.1", port=server.port, use_ssl=False, password=None,
+                       max_attempts=3, retry_delay=0.01)
+
+
+def test_transient_failure_is_retried_until_delivered():
+    with FakeSMTPServer(data_replies=["451 Try again later"]) as server:
+        async def scenario():
+            sender = make_sender(server)
+            delivered = await asyncio.wait_for(sender.send_key("user@waveaccess.global", "123456"), timeout=5)
+            await sender.close()
+            return delivered, sender
+
+        delivered, sender = asyncio.run(scenario())
+
+    assert delivered is True
+    assert server.data_attempts == 2
+    assert server.received == ["user@waveaccess.global"]
+    assert (sender.sent, sender.failed) == (1, 0)
+
+
+def test_permanent_failure_is_not_retried():
+    with FakeSMTPServer(rcpt_replies=["550 No such user"] * 3) as server:
+        async def scenario():
+            sender = make_sender(server)
+            delivered = await asyncio.wait_for(sender.send_key("nobody@waveaccess.global", "123456"), timeout=5)
+            await sender.close()
+            return delivered, sender
+
+        delivered, sender = asyncio.run(scenario())
+
+    assert delivered is False
+    assert server.rcpt_attempts == 1
+    assert server.received == []
+    assert (sender.sent, sender.failed) == (0, 1)
+
+
+def test_idle_connection_is_checked_with_noop_and_reopened(monkeypatch):
+    # Любой простой считается долгим: перед каждым письмом соединение проверяется NOOP
+    monkeypatch.setattr(email_key, "MAIL_NOOP_AFTER", 0)
+    with FakeSMTPServer(close_after_message=True) as server:
+        async def scenario():
+            sender = make_sender(server)
+            first = await asyncio.wait_for(sender.send_key("a@waveaccess.global", "1"), timeout=5)
+            second = await asyncio.wait_for(sender.send_key("b@waveaccess.global", "2"), timeout=5)
+            await sender.close()
+            return first, second, sender
+
+        first, second, sender = asyncio.run(scenario())
+
+    assert first is second is True
+    # Сервер закрыл соединение после первого письма - второе ушло по новому без ошибок и повторов
+    assert server.connections == 2
+    assert sender.reconnects == 2
+    assert server.received == ["a@waveaccess.global", "b@waveaccess.global"]
@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import fakeredis
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from redis.asyncio.client import Pipeline
+
+from app.redis_storage import RedisStorage
+
+
+class Form(StatesGroup):
+    waiting = State()
+    done = State()
+
+
+def make_key(user_id: int = 1) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+def make_storage(server: fakeredis.FakeServer, ttl: int = 0) -> RedisStorage:
+    # Каждый экземпляр - отдельный клиент одного сервера, как у разных процессов бота
+    return RedisStorage(fakeredis.FakeAsyncRedis(server=server, decode_responses=True), prefix="test", ttl=ttl)
+
+
+def test_state_and_data_roundtrip():
+    async def scenario():
+        storage = make_storage(fakeredis.FakeServer())
+        key = make_key()
+        assert await storage.get_state(key) is None
+        assert await storage.get_data(key) == {}
+
+        await storage.set_state(key, Form.waiting)
+        await storage.set_data(key, {"login": "a@waveaccess.global"})
+        result = await storage.get_state(key), await storage.get_data(key)
+
+        await storage.set_state(key, None)
+        cleared = await storage.get_state(key)
+        await storage.close()
+        return result, cleared
+
+    (state, data), cleared = asyncio.run(scenario())
+    assert state == Form.waiting.state
+    assert data == {"login": "a@waveaccess.global"}
+    assert cleared is None
+
+
+def test_update_data_retries_on_watch_conflict(monkeypatch):
+    server = fakeredis.FakeServer()
+    storage = make_storage(server)
+    key = make_key()
+    # «Другой процесс» пишет в ту же запись между WATCH и MULTI первой попытки
+    rival = fakeredis.FakeRedis(server=server, decode_responses=True)
+    attempts = []
+    multi = Pipeline.multi
+
+    def interfering_multi(self):
+        attempts.append(1)
+        if len(attempts) == 1:
+            rival.hset(storage._key(key), "data", json.dumps({"rival": 1, "a": 0}))
+        return multi(self)
+
+    monkeypatch.setattr(Pipeline, "multi", interfering_multi)
+
+    async def scenario():
+        await storage.set_data(key, {"a": 0})
+        result = await storage.update_data(key, {"a": 1})
+        data = await storage.get_data(key)
+        await storage.close()
+        return result, data
+
+    result, data = asyncio.run(scenario())
+    # Первая транзакция отклонена (WatchError), повтор увидел запись соперника и не затёр её
+    assert len(attempts) == 2
+    assert result == data == {"rival": 1, "a": 1}
+
+
+def test_ttl_is_refreshed_on_write():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        storage = make_storage(server, ttl=100)
+        forever = make_storage(server, ttl=0)
+        await storage.set_state(make_key(1), Form.waiting)
+        await storage.update_data(make_key(1), {"a": 1})
+        await forever.set_state(make_key(2), Form.waiting)
+        ttls = (await storage.redis.ttl(storage._key(make_key(1))),
+                await forever.redis.ttl(forever._key(make_key(2))))
+        await storage.close()
+        await forever.close()
+        return ttls
+
+    limited, unlimited = asyncio.run(scenario())
+    assert 0 < limited <= 100
+    assert unlimited == -1
+
+
+def test_bulk_set():
+    async def scenario():
+        storage = make_storage(fakeredis.FakeServer(), ttl=100)
+        keys = [make_key(user_id) for user_id in range(1, 6)]
+        await storage.set_data(keys[0], {"old": True})
+        await storage.bulk_set(keys, Form.done, {"is_admin": "false"})
+        result = [(await storage.get_state(key), await storage.get_data(key)) for key in keys]
+        ttl = await storage.redis.ttl(storage._key(keys[-1]))
+
+        await storage.bulk_set(keys[:2], None, {})
+        cleared = [await storage.get_state(key) for key in keys[:2]]
+        await storage.close()
+        return result, ttl, cleared
+
+    result, ttl, cleared = asyncio.run(scenario())
+    assert result == [(Form.done.state, {"is_admin": "false"})] * 5
+    assert 0 < ttl <= 100
+    assert cleared == [None, None]
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import signal
+import socket
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+import app.webhook as webhook
+
+SECRET = "test-secret"
+
+
+def synthetic_update(update_id: int, text: str) -> dict:
+    """Обновление в том виде, в каком его присылает Telegram"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": 111, "type": "private"},
+            "from": {"id": 111, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+def make_dispatcher(received: list, done: asyncio.Event) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        received.append(message.text)
+        done.set()
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def test_webhook_accepts_synthetic_update(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", SECRET)
+
+    async def scenario():
+        received, done = [], asyncio.Event()
+        bot = Bot(token="42:TEST")
+        app = webhook.create_app(make_dispatcher(received, done), bot)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post(webhook.WEBHOOK_PATH, json=synthetic_update(1, "привет"),
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            assert response.status == 200
+            # Обновление обрабатывается в фоне после ответа Telegram
+            await asyncio.wait_for(done.wait(), timeout=5)
+
+            health = await client.get(webhook.HEALTH_PATH)
+            assert health.status == 200
+            assert await health.json() == {"status": "ok"}
+        await bot.session.close()
+        return received
+
+    assert asyncio.run(scenario()) == ["привет"]
+
+
+def test_webhook_rejects_wrong_secret(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", SECRET)
+
+    async def scenario():
+        received, done = [], asyncio.Event()
+        bot = Bot(token="42:TEST")
+        app = webhook.create_app(make_dispatcher(received, done), bot)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post(webhook.WEBHOOK_PATH, json=synthetic_update(2, "чужой"),
+                                         headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            status = response.status
+        await bot.session.close()
+        return status, received
+
+    status, received = asyncio.run(scenario())
+    assert status == 401
+    assert received == []
+
+
+def test_run_webhook_stops_on_sigterm(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    monkeypatch.setattr(webhook, "WEBHOOK_HOST", "127.0.0.1")
+    monkeypatch.setattr(webhook, "WEBHOOK_PORT", port)
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", "")
+
+    async def scenario():
+        bot = Bot(token="42:TEST")
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.3, os.kill, os.getpid(), signal.SIGTERM)
+        # Без обработчика сигнала процесс был бы убит, а не дошёл до return
+        await asyncio.wait_for(webhook.run_webhook(Dispatcher(), bot), timeout=5)
+        await bot.session.close()
+
+    asyncio.run(scenario())